@@ -0,0 +1,87 @@
+"""
+Замер аналитики курсов: 170 валют за 5 лет - весь путь ручки: чтение дневных курсов из базы
+(load_series), сборка матрицы, расчёт показателей и ответ.
+
+База - временный SQLite, курсы заполнены целиком (без обращений к внешнему API).
+
+Запуск: python -m benchmarks.analytics
+"""
+import asyncio
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from tortoise import Tortoise
+
+from users.analytics import build_matrix, compute_analytics, rate_analytics
+from users.currency import CurrencyType
+from users.models import DailyRate
+from users.timeseries import load_series
+
+BASE = "USD"
+SYMBOLS = [currency.name for currency in CurrencyType if currency.name != BASE][:170]
+DAYS = 5 * 365
+WINDOWS = [7, 30, 90]
+REPEAT = 5
+
+
+async def seed(start: date) -> None:
+    """
+    Случайное блуждание курсов за каждый день периода
+    """
+    rng = np.random.default_rng(42)
+    walk = np.exp(np.cumsum(rng.normal(0, 0.01, size=(len(SYMBOLS), DAYS)), axis=1))
+    for row, symbol in enumerate(SYMBOLS):
+        await DailyRate.bulk_create([
+            DailyRate(
+                date=start + timedelta(days=day), base=BASE, symbol=symbol, rate=Decimal(f"{walk[row, day]:.12f}")
+            )
+            for day in range(DAYS)
+        ])
+
+
+async def timed(func, *args) -> tuple[float, object]:
+    best, result = float('inf'), None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        result = func(*args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+async def run(directory: str) -> None:
+    await Tortoise.init(
+        db_url=f"sqlite://{os.path.join(directory, 'bench.db')}", modules={"models": ["users.models"]}
+    )
+    await Tortoise.generate_schemas()
+    try:
+        # вчерашний день - последний: сегодняшний курс берётся из внешнего API
+        end = date.today() - timedelta(days=1)
+        start = end - timedelta(days=DAYS - 1)
+        await seed(start)
+
+        load_time, series = await timed(load_series, BASE, SYMBOLS, start, end)
+        build_time, (_, matrix) = await timed(build_matrix, series, start, end)
+        compute_time, _ = await timed(compute_analytics, matrix, WINDOWS, True)
+        total_time, _ = await timed(rate_analytics, BASE, SYMBOLS, start, end, WINDOWS, True)
+        print(f"валют: {matrix.shape[0]}, дней: {matrix.shape[1]}")
+        print(f"чтение курсов из базы: {load_time * 1000:.1f} мс")
+        print(f"сборка матрицы: {build_time * 1000:.1f} мс")
+        print(f"расчёт показателей и корреляций: {compute_time * 1000:.1f} мс")
+        print(f"всего (rate_analytics): {total_time * 1000:.1f} мс")
+    finally:
+        await Tortoise.close_connections()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run(directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Пропускная способность /users/convert на SQLite: журнал DELETE и WAL,
+synchronous=NORMAL и FULL, с групповой фиксацией и без.
+
+Каждый режим запускается в отдельном процессе на новой базе, курсы - локальный заменитель API.
+
+Запуск: python -m benchmarks.convert [--users 20] [--requests 50]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = {
+    "DELETE + FULL": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL"},
+    "WAL + NORMAL": {"SQLITE_JOURNAL_MODE": "WAL", "SQLITE_SYNCHRONOUS": "NORMAL"},
+    "WAL + NORMAL + group commit": {
+        "SQLITE_JOURNAL_MODE": "WAL", "SQLITE_SYNCHRONOUS": "NORMAL", "SQLITE_GROUP_COMMIT": "true"
+    },
+    "WAL + FULL": {"SQLITE_JOURNAL_MODE": "WAL", "SQLITE_SYNCHRONOUS": "FULL"},
+    "WAL + FULL + group commit": {
+        "SQLITE_JOURNAL_MODE": "WAL", "SQLITE_SYNCHRONOUS": "FULL", "SQLITE_GROUP_COMMIT": "true"
+    },
+}
+
+ENVIRONMENT = {
+    "API_PROVIDER": "local",
+    "RATE_LIMIT_ENABLED": "false",
+    "LEDGER_JOBS_ENABLED": "false",
+    "AUTH_HASHER_ROUNDS": "4",
+}
+
+
+async def prepare(client, users: int) -> list[dict[str, str]]:
+    from users.models import Users
+
+    headers = []
+    for number in range(users):
+        username = f"bench{number}"
+        user = {"username": username, "first_name": "bench", "last_name": "bench", "password": "password1"}
+        await client.post("/users/register", json=user)
+        await Users.filter(username=username).update(is_approved=True)
+        token = (await client.post("/users/token", data={"username": username, "password": "password1"})).json()
+        auth = {"Authorization": f"Bearer {token['access_token']}"}
+        await client.patch("/users/refill", params={"amount": "1000000", "currency": "RUB"}, headers=auth)
+        await client.post("/users/create_check", params={"currency": "USD"}, headers=auth)
+        headers.append(auth)
+    return headers
+
+
+async def measure(users: int, requests: int) -> None:
+    import httpx
+    import main
+
+    await main.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            headers = await prepare(client, users)
+
+            async def worker(auth: dict[str, str]) -> int:
+                failed = 0
+                for _ in range(requests):
+                    response = await client.put(
+                        "/users/convert", params={"type_from": "RUB", "type_to": "USD", "value": "10"}, headers=auth
+                    )
+                    failed += response.status_code != 200
+                return failed
+
+            started = time.perf_counter()
+            failed = sum(await asyncio.gather(*(worker(auth) for auth in headers)))
+            elapsed = time.perf_counter() - started
+        total = users * requests
+        print(f"{total / elapsed:.0f} {failed}")
+    finally:
+        await main.app.router.shutdown()
+
+
+def run_mode(mode: dict[str, str], users: int, requests: int) -> tuple[float, int]:
+    with tempfile.TemporaryDirectory() as directory:
+        environment = {
+            **os.environ, **ENVIRONMENT, **mode, "DATABASE_NAME": os.path.join(directory, "bench")
+        }
+        command = [sys.executable, "-m", "benchmarks.convert", "--worker", "--users", str(users), "--requests", str(requests)]
+        output = subprocess.run(command, env=environment, capture_output=True, text=True, check=True).stdout.split()
+    return float(output[-2]), int(output[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--worker", action="store_true")
+    args = parser.parse_args()
+    if args.worker:
+        asyncio.run(measure(args.users, args.requests))
+        return
+    print(f"пользователей: {args.users}, конвертаций на пользователя: {args.requests}")
+    for name, mode in MODES.items():
+        throughput, failed = run_mode(mode, args.users, args.requests)
+        print(f"{name:<30} {throughput:>7.0f} запросов/с" + (f" (ошибок: {failed})" if failed else ""))
+
+
+if __name__ == "__main__":
+    main()
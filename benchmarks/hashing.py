@@ -0,0 +1,43 @@
+"""
+Подбор стоимости bcrypt: время одного хэширования для каждой стоимости
+и наибольшая, при которой проверка пароля при входе укладывается в бюджет.
+
+Результат задаётся в AUTH_HASHER_ROUNDS на всех узлах.
+
+Запуск: python -m benchmarks.hashing [--budget 0.25]
+"""
+import argparse
+import time
+
+from passlib.context import CryptContext
+
+from config import auth_config
+
+
+def hash_time(rounds: int) -> float:
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    started = time.perf_counter()
+    context.hash("calibration-password")
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=float, default=0.25, help="секунд на одну проверку пароля")
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=16)
+    args = parser.parse_args()
+
+    recommended = args.min_rounds
+    for rounds in range(args.min_rounds, args.max_rounds + 1):
+        seconds = hash_time(rounds)
+        print(f"стоимость {rounds}: {seconds * 1000:.1f} мс")
+        if seconds > args.budget:
+            break
+        recommended = rounds
+    print(f"текущая стоимость: {auth_config['hasher_rounds']}")
+    print(f"рекомендуемая для бюджета {args.budget} с: {recommended} (AUTH_HASHER_ROUNDS)")
+
+
+if __name__ == "__main__":
+    main()
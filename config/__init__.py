@@ -2,7 +2,8 @@ import os
 from typing import Any
 
 from config.settings import (
-    ApplicationSettings, AuthSettings, CORSSettings, DataBaseSettings, SiteSettings, CurrencyApiSettings
+    ApplicationSettings, AuthSettings, CORSSettings, DataBaseSettings, SiteSettings, CurrencyApiSettings,
+    RateLimitSettings, PaginationSettings, LedgerSettings, ArchiveSettings
 )
 
 base_dir: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -13,3 +14,7 @@ cors_config: dict[str, Any] = CORSSettings().dict()
 auth_config: dict[str, Any] = AuthSettings().dict()
 database_config: dict[str, Any] = DataBaseSettings().dict()
 currency_api_conf: dict[str, Any] = CurrencyApiSettings().dict()
+rate_limit_config: dict[str, Any] = RateLimitSettings().dict()
+pagination_config: dict[str, Any] = PaginationSettings().dict()
+ledger_config: dict[str, Any] = LedgerSettings().dict()
+archive_config: dict[str, Any] = ArchiveSettings().dict()
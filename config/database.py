@@ -0,0 +1,80 @@
+from typing import Any
+
+from tortoise.backends.base.config_generator import expand_db_url
+
+MODELS = ["users.models"]
+
+
+def pool_settings(config: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "minsize": config["pool_min"],
+        "maxsize": config["pool_max"],
+        "statement_cache_size": config["statement_cache_size"],
+        "max_inactive_connection_lifetime": config["max_inactive_connection_lifetime"],
+        "timeout": config["connect_timeout"],
+        "command_timeout": config["command_timeout"],
+        "server_settings": {"statement_timeout": str(config["statement_timeout"])},
+    }
+
+
+def postgres_credentials(config: dict[str, Any], host: str, port: int) -> dict[str, Any]:
+    return {
+        "host": host,
+        "port": port,
+        "user": config["user"],
+        "password": config["password"],
+        "database": config["db_name"],
+        **pool_settings(config),
+    }
+
+
+def sqlite_connection(config: dict[str, Any], url: str | None = None) -> dict[str, Any]:
+    connection = expand_db_url(url or config["database_url"].format(**config))
+    connection["credentials"].update(
+        journal_mode=config["sqlite_journal_mode"],
+        synchronous=config["sqlite_synchronous"],
+        mmap_size=config["sqlite_mmap_size"],
+        cache_size=config["sqlite_cache_size"],
+        busy_timeout=config["sqlite_busy_timeout"],
+    )
+    return connection
+
+
+def shard_connection(config: dict[str, Any], url: str) -> dict[str, Any]:
+    """
+    Соединение шарда по URL: sqlite с теми же PRAGMA, postgres с теми же настройками пула
+    """
+    if url.startswith("sqlite"):
+        return sqlite_connection(config, url)
+    connection = expand_db_url(url)
+    connection["credentials"].update(pool_settings(config))
+    return connection
+
+
+def tortoise_config(config: dict[str, Any]) -> dict[str, Any]:
+    """
+    Конфигурация Tortoise: sqlite или postgres (default), если задана, реплика для чтения (replica)
+    и шарды данных пользователей (shard_0, shard_1, ...)
+    """
+    if config["engine"] == "postgres":
+        connections = {
+            "default": {
+                "engine": "tortoise.backends.asyncpg",
+                "credentials": postgres_credentials(config, config["host"], config["port"]),
+            }
+        }
+        if config["replica_host"]:
+            connections["replica"] = {
+                "engine": "tortoise.backends.asyncpg",
+                "credentials": postgres_credentials(
+                    config, config["replica_host"], config["replica_port"] or config["port"]
+                ),
+            }
+    else:
+        connections = {"default": sqlite_connection(config)}
+    for number, url in enumerate(config["shard_urls"]):
+        connections[f"shard_{number}"] = shard_connection(config, url)
+    return {
+        "connections": connections,
+        "apps": {"models": {"models": MODELS, "default_connection": "default"}},
+    }
@@ -22,18 +22,48 @@ class ApplicationSettings(BaseSettings):
 
 
 class DataBaseSettings(BaseSettings):
+    # sqlite или postgres
+    engine: str = Field("sqlite", env="DATABASE_ENGINE")
+    db_name: str = Field("db_app", env="DATABASE_NAME")
 
     # postgres
-    # database_url: str = Field("postgres://{user}:{password}@{host}:{port}/{database}")
-    # port: str = Field("5432", env="DATABASE_PORT")
-    # user: str = Field("postgres", env="DATABASE_USER")
-    # host: str = Field("db_app", env="DATABASE_HOST")
-    # password: str = Field("postgres", env="DATABASE_PASSWORD")
-    # database: str = Field("postgres", env="DATABASE_NAME")
+    host: str = Field("db_app", env="DATABASE_HOST")
+    port: int = Field(5432, env="DATABASE_PORT")
+    user: str = Field("postgres", env="DATABASE_USER")
+    password: str = Field("postgres", env="DATABASE_PASSWORD")
+    # пул asyncpg
+    pool_min: int = Field(5, env="DATABASE_POOL_MIN")
+    pool_max: int = Field(20, env="DATABASE_POOL_MAX")
+    statement_cache_size: int = Field(100, env="DATABASE_STATEMENT_CACHE_SIZE")
+    max_inactive_connection_lifetime: float = Field(300.0, env="DATABASE_MAX_INACTIVE_LIFETIME")
+    connect_timeout: float = Field(5.0, env="DATABASE_CONNECT_TIMEOUT")
+    command_timeout: float = Field(10.0, env="DATABASE_COMMAND_TIMEOUT")
+    # statement_timeout на стороне сервера, мс
+    statement_timeout: int = Field(10000, env="DATABASE_STATEMENT_TIMEOUT")
+    # реплика для чтения; пусто - чтение с основной базы
+    replica_host: str | None = Field(None, env="DATABASE_REPLICA_HOST")
+    replica_port: int | None = Field(None, env="DATABASE_REPLICA_PORT")
 
     # sqlite
     database_url: str = Field("sqlite://{db_name}.db")
-    db_name: str = Field("db_app", env="DATABASE_NAME")
+    # PRAGMA при открытии соединения
+    sqlite_journal_mode: str = Field("WAL", env="SQLITE_JOURNAL_MODE")
+    sqlite_synchronous: str = Field("NORMAL", env="SQLITE_SYNCHRONOUS")
+    sqlite_mmap_size: int = Field(256*1024*1024, env="SQLITE_MMAP_SIZE")
+    # отрицательное значение - размер в КиБ
+    sqlite_cache_size: int = Field(-64*1024, env="SQLITE_CACHE_SIZE")
+    sqlite_busy_timeout: int = Field(5000, env="SQLITE_BUSY_TIMEOUT")
+    # групповая фиксация коротких транзакций записи
+    group_commit: bool = Field(False, env="SQLITE_GROUP_COMMIT")
+    group_commit_max_batch: int = Field(64, env="SQLITE_GROUP_COMMIT_MAX_BATCH")
+    group_commit_max_delay: float = Field(0.0, env="SQLITE_GROUP_COMMIT_MAX_DELAY")
+
+    # шарды данных пользователей (счета, переводы, конвертации, журнал) - URL Tortoise,
+    # пользователь живёт на шарде user_id % len(shard_urls); пусто - всё в основной базе
+    shard_urls: list[str] = Field([], env="DATABASE_SHARD_URLS")
+    # восстановление переводов между шардами, прерванных сбоем: период и возраст записи журнала
+    shard_recovery_interval: float = Field(30.0, env="DATABASE_SHARD_RECOVERY_INTERVAL")
+    shard_recovery_delay: float = Field(60.0, env="DATABASE_SHARD_RECOVERY_DELAY")
 
     class Config:
         env_file = ".env"
@@ -45,8 +75,22 @@ class AuthSettings(BaseSettings):
     password_time: int = Field(3)
     algorithm: str = Field("HS256")
     expires: int = Field(60*60)
+    refresh_expires: int = Field(30*24*60*60, env="AUTH_REFRESH_EXPIRES")
     hasher_deprecated: str = Field("auto")
     hasher_schemes: list[str] = Field(["bcrypt"])
+    # стоимость bcrypt (подбор: python -m benchmarks.hashing): при изменении хэши пересчитываются при входе
+    hasher_rounds: int = Field(12, env="AUTH_HASHER_ROUNDS")
+    # пул для хэширования: thread или process
+    hasher_pool: str = Field("thread", env="AUTH_HASHER_POOL")
+    hasher_pool_size: int = Field(4, env="AUTH_HASHER_POOL_SIZE")
+
+    # кэш пользователей для get_current_user; сбрасывается только в своём процессе,
+    # поэтому при нескольких воркерах ttl - задержка, с которой видны подтверждение и смена прав
+    principal_cache_ttl: float = Field(10.0, env="AUTH_PRINCIPAL_CACHE_TTL")
+    principal_cache_size: int = Field(10000, env="AUTH_PRINCIPAL_CACHE_SIZE")
+
+    # проверенные токены (по хэшу токена, не дольше срока действия)
+    token_cache_size: int = Field(10000, env="AUTH_TOKEN_CACHE_SIZE")
 
     secret_key: str = Field("secret_key", env="AUTH_SECRET_KEY")
 
@@ -74,3 +118,127 @@ class CurrencyApiSettings(BaseSettings):
     apikey: str = Field(CurrencyApiHeaders().apikey)
     headers: dict = CurrencyApiHeaders().dict()
     url: str = Field("https://api.apilayer.com/exchangerates_data", env="API_URL")
+
+    # источник курсов: apilayer, local или цепочка с резервом, например "apilayer,local"
+    provider: str = Field("apilayer", env="API_PROVIDER")
+
+    # локальный заменитель API (без local_url запускается в том же процессе)
+    local_url: str | None = Field(None, env="API_LOCAL_URL")
+    local_latency: float = Field(0.0, env="API_LOCAL_LATENCY")
+    local_jitter: float = Field(0.0, env="API_LOCAL_JITTER")
+    local_fixture: str | None = Field(None, env="API_LOCAL_FIXTURE")
+
+    # пул соединений httpx
+    http2: bool = Field(True, env="API_HTTP2")
+    max_connections: int = Field(100, env="API_MAX_CONNECTIONS")
+    max_keepalive_connections: int = Field(20, env="API_MAX_KEEPALIVE_CONNECTIONS")
+    keepalive_expiry: float = Field(30.0, env="API_KEEPALIVE_EXPIRY")
+
+    # таймауты по фазам запроса (секунды)
+    connect_timeout: float = Field(3.0, env="API_CONNECT_TIMEOUT")
+    read_timeout: float = Field(5.0, env="API_READ_TIMEOUT")
+    write_timeout: float = Field(5.0, env="API_WRITE_TIMEOUT")
+    pool_timeout: float = Field(2.0, env="API_POOL_TIMEOUT")
+
+    # устойчивость к сбоям API
+    request_deadline: float = Field(10.0, env="API_REQUEST_DEADLINE")
+    breaker_failure_threshold: int = Field(5, env="API_BREAKER_FAILURE_THRESHOLD")
+    breaker_reset_timeout: float = Field(30.0, env="API_BREAKER_RESET_TIMEOUT")
+    hedge_enabled: bool = Field(False, env="API_HEDGE_ENABLED")
+    hedge_percentile: float = Field(95.0, env="API_HEDGE_PERCENTILE")
+    hedge_min_delay: float = Field(0.05, env="API_HEDGE_MIN_DELAY")
+    hedge_min_samples: int = Field(20, env="API_HEDGE_MIN_SAMPLES")
+    latency_window: int = Field(200, env="API_LATENCY_WINDOW")
+
+    # локальная таблица курсов
+    rates_base: str = Field("EUR", env="API_RATES_BASE")
+    rates_ttl: float = Field(60.0, env="API_RATES_TTL")
+    rates_stale_grace: float = Field(300.0, env="API_RATES_STALE_GRACE")
+
+    # история курсов: максимум дней в одном запросе /timeseries
+    timeseries_max_days: int = Field(365, env="API_TIMESERIES_MAX_DAYS")
+
+    # максимум пар в одном пакетном запросе цен
+    batch_max_items: int = Field(100, env="API_BATCH_MAX_ITEMS")
+
+    # зафиксированные котировки для /convert
+    quote_ttl: float = Field(30.0, env="API_QUOTE_TTL")
+    quote_max_items: int = Field(100000, env="API_QUOTE_MAX_ITEMS")
+
+    # справочник валют
+    symbols_ttl: float = Field(24*60*60, env="API_SYMBOLS_TTL")
+    symbols_stale_grace: float = Field(7*24*60*60, env="API_SYMBOLS_STALE_GRACE")
+
+    # фоновое обновление и прогрев
+    refresh_interval: float = Field(5.0, env="API_REFRESH_INTERVAL")
+    refresh_ahead: float = Field(10.0, env="API_REFRESH_AHEAD")
+    warmup_timeout: float = Field(15.0, env="API_WARMUP_TIMEOUT")
+
+
+class RateLimitSettings(BaseSettings):
+    enabled: bool = Field(True, env="RATE_LIMIT_ENABLED")
+    # memory - корзины в процессе, redis - общие для всех воркеров
+    backend: str = Field("memory", env="RATE_LIMIT_BACKEND")
+    redis_url: str = Field("redis://localhost:6379/0", env="RATE_LIMIT_REDIS_URL")
+    max_buckets: int = Field(100000, env="RATE_LIMIT_MAX_BUCKETS")
+    idle_ttl: float = Field(10*60, env="RATE_LIMIT_IDLE_TTL")
+    # брать IP клиента из X-Forwarded-For (только за доверенным прокси)
+    trust_forwarded: bool = Field(False, env="RATE_LIMIT_TRUST_FORWARDED")
+    # ручка -> {"ip" | "user": "запросов/секунд"}
+    routes: dict[str, dict[str, str]] = Field(
+        {
+            "token": {"ip": "30/60", "user": "10/60"},
+            "token_refresh": {"ip": "60/60"},
+            "get_price": {"ip": "120/60", "user": "60/60"},
+            "get_prices": {"ip": "60/60", "user": "30/60"},
+            "convert": {"user": "60/60"},
+        },
+        env="RATE_LIMIT_ROUTES",
+    )
+
+    class Config:
+        env_file = ".env"
+        env_file_encoding = "utf-8"
+
+
+class PaginationSettings(BaseSettings):
+    default_limit: int = Field(50, env="PAGE_DEFAULT_LIMIT")
+    max_limit: int = Field(500, env="PAGE_MAX_LIMIT")
+    # размер порции при потоковой выгрузке
+    export_chunk_size: int = Field(1000, env="EXPORT_CHUNK_SIZE")
+
+    class Config:
+        env_file = ".env"
+        env_file_encoding = "utf-8"
+
+
+class LedgerSettings(BaseSettings):
+    # снимки остатков и сверка журнала со счетами
+    snapshot_interval: float = Field(60*60, env="LEDGER_SNAPSHOT_INTERVAL")
+    # не трогать свежие проводки: их транзакции могли ещё не завершиться
+    snapshot_lag: float = Field(5.0, env="LEDGER_SNAPSHOT_LAG")
+    # пропуск в id проводок - незавершённая транзакция; пропуск старше этого срока - откаченная
+    snapshot_gap_timeout: float = Field(10*60, env="LEDGER_SNAPSHOT_GAP_TIMEOUT")
+    reconcile_interval: float = Field(10*60, env="LEDGER_RECONCILE_INTERVAL")
+    chunk_size: int = Field(1000, env="LEDGER_CHUNK_SIZE")
+    jobs_enabled: bool = Field(True, env="LEDGER_JOBS_ENABLED")
+
+    class Config:
+        env_file = ".env"
+        env_file_encoding = "utf-8"
+
+
+class ArchiveSettings(BaseSettings):
+    # перенос старых конвертаций в сжатые файлы сегментов (у каждой базы/шарда - свой каталог)
+    jobs_enabled: bool = Field(False, env="ARCHIVE_JOBS_ENABLED")
+    directory: str = Field("archive", env="ARCHIVE_DIRECTORY")
+    after_days: int = Field(90, env="ARCHIVE_AFTER_DAYS")
+    interval: float = Field(6*60*60, env="ARCHIVE_INTERVAL")
+    segment_rows: int = Field(50000, env="ARCHIVE_SEGMENT_ROWS")
+    # строк в сжатом блоке: блок - единица чтения, в заголовке - его диапазон (пользователь, время)
+    block_rows: int = Field(256, env="ARCHIVE_BLOCK_ROWS")
+    compress_level: int = Field(6, env="ARCHIVE_COMPRESS_LEVEL")
+
+    class Config:
+        env_file = ".env"
+        env_file_encoding = "utf-8"
@@ -1,22 +1,55 @@
 from fastapi import FastAPI
 from tortoise.contrib.fastapi import register_tortoise
 from users.api import users_router
+from users.converter import open_client, close_client, start_refresher, stop_refresher
 
-from config import app_config, database_config, site_config
+from users.hashing import shutdown_executor
+from users.security import load_revocations
+from users.resilience import DeadlineMiddleware
+from users.migrations import upgrade_schema
+from users.db import stop_group_commit
+from users.ledger import start_ledger_jobs, stop_ledger_jobs
+from users.twophase import start_transfer_recovery, stop_transfer_recovery
+from users.archive import start_archive_jobs, stop_archive_jobs
+
+from config import app_config, database_config, site_config, currency_api_conf
+from config.database import tortoise_config
 
 app = FastAPI(**app_config)
+app.add_middleware(DeadlineMiddleware, seconds=currency_api_conf.get('request_deadline'))
 
 register_tortoise(
     app,
-    db_url=database_config.get('database_url').format(**database_config),
-    modules={"models": ["users.models"]},
-    generate_schemas=True,
+    config=tortoise_config(database_config),
+    generate_schemas=False,
     add_exception_handlers=True,
 )
 
 app.include_router(users_router)
 
 
+@app.on_event("startup")
+async def startup():
+    await upgrade_schema()
+    await open_client()
+    await start_refresher()
+    await load_revocations()
+    start_ledger_jobs()
+    start_transfer_recovery()
+    start_archive_jobs()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_archive_jobs()
+    await stop_transfer_recovery()
+    await stop_ledger_jobs()
+    await stop_group_commit()
+    await stop_refresher()
+    await close_client()
+    shutdown_executor()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", **site_config)
@@ -0,0 +1,35 @@
+import pytest
+from tortoise import Tortoise
+
+from config import database_config
+from config.database import tortoise_config
+from users.migrations import upgrade_schema
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def shard_count() -> int:
+    """
+    Число шардов (файлов SQLite) для database; 0 - всё в основной базе
+    """
+    return 0
+
+
+@pytest.fixture
+async def database(tmp_path, monkeypatch, shard_count):
+    """
+    Основная база и шарды - отдельные файлы SQLite во временном каталоге
+    """
+    monkeypatch.setitem(database_config, "engine", "sqlite")
+    monkeypatch.setitem(database_config, "database_url", f"sqlite://{tmp_path}/app.db")
+    monkeypatch.setitem(
+        database_config, "shard_urls", [f"sqlite://{tmp_path}/shard{number}.db" for number in range(shard_count)]
+    )
+    await Tortoise.init(config=tortoise_config(database_config))
+    await upgrade_schema()
+    yield
+    await Tortoise.close_connections()
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from config import archive_config
+from users import archive
+from users.archive import ID, TS, USER, Segment, cold_export_rows, cold_rows, from_ts, to_ts, write_segment
+from users.pagination import PageParams
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+USERS, ROWS_PER_USER, BLOCK_ROWS = 40, 20, 20
+
+
+def history(first_id: int, users: range) -> list[list]:
+    """
+    Конвертации: у каждого пользователя свой отрезок времени, блок - один пользователь
+    """
+    rows = []
+    for user_id in users:
+        for number in range(ROWS_PER_USER):
+            moment = START + timedelta(hours=user_id, minutes=number)
+            rows.append([first_id + len(rows), user_id, "RUB", "USD", "10", "0.16", to_ts(moment)])
+    return rows
+
+
+@pytest.fixture
+def segments(tmp_path, monkeypatch):
+    monkeypatch.setitem(archive_config, "directory", str(tmp_path))
+    monkeypatch.setattr(archive, "archives", {})
+    directory = tmp_path / "default"
+    directory.mkdir()
+    first = history(1, range(0, USERS // 2))
+    second = history(len(first) + 1, range(USERS // 2, USERS))
+    for rows in (first, second):
+        write_segment(str(directory / f"{rows[0][ID]:012d}-{rows[-1][ID]:012d}.seg"), rows, 0, BLOCK_ROWS, 6)
+    yield first + second
+    archive.archive("default").close()
+
+
+@pytest.fixture
+def reads(monkeypatch) -> list[int]:
+    """
+    Число распакованных блоков
+    """
+    reads = []
+    read_block = Segment.read_block
+
+    def counted(self, block):
+        reads.append(block[archive.OFFSET])
+        return read_block(self, block)
+
+    monkeypatch.setattr(Segment, "read_block", counted)
+    return reads
+
+
+def page(limit: int, cursor: list | None = None) -> PageParams:
+    params = PageParams(limit=limit)
+    if cursor is not None:
+        params.cursor = (from_ts(cursor[TS]), cursor[ID])
+    return params
+
+
+def test_admin_page_reads_only_newest_blocks(segments, reads):
+    rows = cold_rows("default", page(10), None, None, None)
+    newest = sorted(segments, key=lambda row: (row[TS], row[ID]), reverse=True)
+    assert rows == newest[:11]
+    assert len(reads) == 1
+
+
+def test_pages_follow_cursor(segments, reads):
+    newest = sorted(segments, key=lambda row: (row[TS], row[ID]), reverse=True)
+    seen, cursor = [], None
+    while True:
+        rows = cold_rows("default", page(15, cursor), None, None, None)
+        seen += rows[:15]
+        if len(rows) <= 15:
+            break
+        cursor = rows[14]
+    assert seen == newest
+    # каждая страница распаковывает не больше двух блоков
+    assert len(reads) <= 2 * (len(segments) // 15 + 1)
+
+
+def test_user_page(segments):
+    rows = cold_rows("default", page(5), 7, None, None)
+    assert [row[USER] for row in rows] == [7] * 6
+    assert rows == sorted(rows, key=lambda row: (row[TS], row[ID]), reverse=True)
+
+
+async def test_export_streams_blocks(segments, reads):
+    exported = [row async for row in cold_export_rows("default")]
+    assert [row["id"] for row in exported] == [row[ID] for row in segments]
+    assert len(reads) == len(segments) // BLOCK_ROWS
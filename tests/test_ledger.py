@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from tortoise.transactions import in_transaction
+
+from users.balances import book_convert
+from users.currency import CurrencyType, PostingKind
+from users.ledger import reconcile, take_snapshots
+from users.models import BalanceSnapshot, Checks, JobCheckpoint, LedgerEntry, Users
+
+pytestmark = pytest.mark.anyio
+
+
+async def open_check(value: Decimal = Decimal(0)) -> Checks:
+    user = await Users.create(username="bob", first_name="b", last_name="b", password="hash")
+    return await Checks.create(owner_id=user.id, currency_type=CurrencyType.RUB, value=value)
+
+
+async def entry(check: Checks, entry_id: int, amount: str, age: float = 60) -> None:
+    await LedgerEntry.create(
+        id=entry_id,
+        operation=f"op{entry_id}",
+        kind=PostingKind.refill,
+        account_id=check.id,
+        currency_type=CurrencyType.RUB,
+        amount=Decimal(amount),
+        created_at=datetime.now(timezone.utc) - timedelta(seconds=age),
+    )
+
+
+async def position(name: str) -> int:
+    return (await JobCheckpoint.get(name=name)).position
+
+
+async def test_snapshots_stop_at_gap(database):
+    check = await open_check()
+    for entry_id in (1, 2, 4):
+        await entry(check, entry_id, "10")
+    assert await take_snapshots(100, lag=0, gap_timeout=600) == 1
+    assert await position("snapshots") == 2
+
+    # транзакция с id 3 завершилась - позиция идёт дальше, остаток учитывает все проводки
+    await entry(check, 3, "5")
+    await take_snapshots(100, lag=0, gap_timeout=600)
+    assert await position("snapshots") == 4
+    latest = await BalanceSnapshot.filter(account_id=check.id).order_by("-entry_id").first()
+    assert latest.balance == Decimal(35)
+
+
+async def test_snapshots_skip_old_gap(database):
+    check = await open_check()
+    for entry_id in (1, 2, 4):
+        await entry(check, entry_id, "10", age=3600)
+    await take_snapshots(100, lag=0, gap_timeout=600)
+    assert await position("snapshots") == 4
+
+
+async def test_reconcile_uses_snapshot_and_tail(database):
+    check = await open_check(Decimal("30.30"))
+    await entry(check, 1, "10.10")
+    await entry(check, 2, "10.10")
+    await take_snapshots(100, lag=0, gap_timeout=600)
+    await entry(check, 3, "10.10")
+    assert await reconcile(100) == []
+
+    await Checks.filter(id=check.id).update(value=Decimal("31"))
+    mismatches = await reconcile(100)
+    assert [(m["check_id"], m["value"], m["ledger"]) for m in mismatches] == [
+        (check.id, Decimal("31.00"), Decimal("30.30"))
+    ]
+
+
+async def test_reconcile_chunks(database):
+    users = [await Users.create(username=f"u{n}", first_name="u", last_name="u", password="h") for n in range(5)]
+    for user in users:
+        await Checks.create(owner_id=user.id, currency_type=CurrencyType.RUB, value=Decimal(1))
+    mismatches = await reconcile(2)
+    assert len(mismatches) == 5
+    assert await position("reconcile") == 0
+
+
+async def test_reconcile_after_fractional_conversion(database):
+    user = await Users.create(username="bob", first_name="b", last_name="b", password="hash")
+    rub = await Checks.create(owner_id=user.id, currency_type=CurrencyType.RUB, value=Decimal(0))
+    usd = await Checks.create(owner_id=user.id, currency_type=CurrencyType.USD, value=Decimal(0))
+    async with in_transaction("default") as connection:
+        await LedgerEntry.create(
+            operation="opening", kind=PostingKind.refill, account_id=rub.id, currency_type=CurrencyType.RUB,
+            amount=Decimal(100), using_db=connection,
+        )
+        await Checks.filter(id=rub.id).using_db(connection).update(value=Decimal(100))
+    # сумма конвертации с 6 знаками: на счёт и в журнал попадает одно и то же округлённое число
+    for _ in range(3):
+        async with in_transaction("default") as connection:
+            await book_convert(connection, rub, Decimal("0.33"), usd, Decimal("0.005412"))
+    async with in_transaction("default") as connection:
+        await book_convert(connection, rub, Decimal(10), usd, Decimal("16.821875"))
+
+    assert await reconcile(1000) == []
+    await take_snapshots(100, lag=0, gap_timeout=600)
+    assert await reconcile(1000) == []
@@ -0,0 +1,33 @@
+import dataclasses
+
+import pytest
+
+from users.models import Users
+from users.principals import Principal, PrincipalCache
+
+
+def principal(user_id: int = 1, username: str = "bob") -> Principal:
+    user = Users(id=user_id, username=username, password="hash", is_superuser=False, is_active=True, is_approved=True)
+    return Principal.from_user(user)
+
+
+def test_principal_has_no_password_and_is_immutable():
+    cached = principal()
+    assert not hasattr(cached, "password")
+    assert cached.role == "user"
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        cached.is_superuser = True
+
+
+def test_invalidate_by_id():
+    cache = PrincipalCache(ttl=60, max_items=10)
+    cache.put(principal())
+    assert cache.get("bob").id == 1
+    cache.invalidate(user_id=1)
+    assert cache.get("bob") is None
+
+
+def test_ttl_expiry():
+    cache = PrincipalCache(ttl=0, max_items=10)
+    cache.put(principal())
+    assert cache.get("bob") is None
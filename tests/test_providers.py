@@ -0,0 +1,90 @@
+import asyncio
+import contextlib
+
+import httpx
+import pytest
+
+from users.providers import FailoverProvider, HttpRateProvider, RateProvider
+from users.resilience import DeadlineExceeded, UpstreamFailed, UpstreamRejected, reset_deadline, set_deadline
+
+pytestmark = pytest.mark.anyio
+
+LATEST = b'{"base": "USD", "rates": {"EUR": 0.9}}'
+
+
+def upstream(status: int = 200, delay: float = 0, content: bytes = LATEST) -> HttpRateProvider:
+    """
+    Источник с поддельным API: фиксированный ответ после задержки
+    """
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(delay)
+        return httpx.Response(status, content=content)
+
+    return HttpRateProvider(name=f"fake_{status}", url="http://fake", transport=httpx.MockTransport(handler))
+
+
+@contextlib.contextmanager
+def deadline(seconds: float):
+    token = set_deadline(seconds)
+    try:
+        yield
+    finally:
+        reset_deadline(token)
+
+
+def test_rate_provider_is_abstract():
+    with pytest.raises(TypeError):
+        RateProvider()
+
+
+async def test_deadline_is_not_breaker_failure():
+    provider = upstream(delay=1)
+    with deadline(0.05), pytest.raises(DeadlineExceeded):
+        await provider.latest("USD")
+    assert provider.breaker.failures == 0
+    assert provider.breaker.state == provider.breaker.CLOSED
+    await provider.close()
+
+
+async def test_server_error_is_breaker_failure():
+    provider = upstream(status=503)
+    with pytest.raises(UpstreamFailed):
+        await provider.latest("USD")
+    assert provider.breaker.failures == 1
+    await provider.close()
+
+
+@pytest.mark.parametrize("upstream_status, status_code", [(400, 400), (404, 400), (401, 502), (403, 502)])
+async def test_client_error_is_rejected(upstream_status, status_code):
+    provider = upstream(status=upstream_status)
+    with pytest.raises(UpstreamRejected) as error:
+        await provider.latest("USD")
+    assert error.value.status_code == status_code
+    assert provider.breaker.failures == 0
+    await provider.close()
+
+
+async def test_failover_on_server_error():
+    provider = FailoverProvider([upstream(status=500), upstream()])
+    assert (await provider.latest("USD"))["base"] == "USD"
+    assert provider.failovers == 1
+    await provider.close()
+
+
+async def test_failover_on_deadline():
+    slow, fast = upstream(delay=1), upstream()
+    provider = FailoverProvider([slow, fast])
+    with deadline(0.4):
+        assert (await provider.latest("USD"))["base"] == "USD"
+    assert provider.failovers == 1
+    assert slow.breaker.failures == 0
+    await provider.close()
+
+
+async def test_no_failover_on_rejected_request():
+    second = upstream()
+    provider = FailoverProvider([upstream(status=400), second])
+    with pytest.raises(UpstreamRejected):
+        await provider.latest("USD")
+    assert second.latency.stats()["samples"] == 0
+    await provider.close()
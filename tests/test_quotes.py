@@ -0,0 +1,49 @@
+from decimal import Decimal
+
+import pytest
+
+from users.quotes import QuoteStore, QuoteUnavailable
+
+
+def issue(store: QuoteStore, user_id: int = 1):
+    return store.issue(user_id=user_id, type_from="RUB", type_to="USD", value=Decimal(10), price=Decimal("0.16"))
+
+
+def test_peek_does_not_consume():
+    store = QuoteStore(ttl=60, max_items=10)
+    quote = issue(store)
+    assert store.peek(quote.id, 1) is quote
+    assert store.peek(quote.id, 1) is quote
+    assert store.peek(quote.id, 2) is None
+
+
+def test_settle_consumes_once():
+    store = QuoteStore(ttl=60, max_items=10)
+    quote = issue(store)
+    with store.settle(quote):
+        pass
+    assert store.peek(quote.id, 1) is None
+    with pytest.raises(QuoteUnavailable):
+        with store.settle(quote):
+            pass
+    assert store.stats()["settled"] == 1
+
+
+def test_settle_restores_on_failure():
+    store = QuoteStore(ttl=60, max_items=10)
+    quote = issue(store)
+    with pytest.raises(RuntimeError):
+        with store.settle(quote):
+            assert store.peek(quote.id, 1) is None
+            raise RuntimeError
+    assert store.peek(quote.id, 1) is quote
+    assert store.stats()["settled"] == 0
+
+
+def test_expired_quote_is_not_settled():
+    store = QuoteStore(ttl=0, max_items=10)
+    quote = issue(store)
+    assert store.peek(quote.id, 1) is None
+    with pytest.raises(QuoteUnavailable):
+        with store.settle(quote):
+            pass
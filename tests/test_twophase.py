@@ -0,0 +1,180 @@
+from decimal import Decimal
+
+import pytest
+
+from users import twophase
+from users.currency import CurrencyType, SystemAccount, TransferState, TransferStep
+from users.models import Checks, LedgerEntry, TransferIntent, TransferPhase, Transfers, Users
+from users.shards import shard_name, user_connection
+from users.twophase import RecipientUnavailable, TransferAborted, recover_transfers, transfer_between_shards
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def shard_count() -> int:
+    return 2
+
+
+@pytest.fixture
+async def checks(database) -> tuple[Checks, Checks]:
+    """
+    Счёт отправителя (100 RUB) и получателя (0 RUB) на разных шардах
+    """
+    sender = await Users.create(username="alice", first_name="a", last_name="a", password="hash")
+    recipient = await Users.create(username="bob", first_name="b", last_name="b", password="hash")
+    assert shard_name(sender.id) != shard_name(recipient.id)
+    check_from = await Checks.create(
+        owner_id=sender.id, currency_type=CurrencyType.RUB, value=Decimal(100), using_db=user_connection(sender.id)
+    )
+    check_to = await Checks.create(
+        owner_id=recipient.id, currency_type=CurrencyType.RUB, value=Decimal(0), using_db=user_connection(recipient.id)
+    )
+    return check_from, check_to
+
+
+async def balance(check: Checks) -> Decimal:
+    return (await Checks.get(id=check.id).using_db(user_connection(check.owner_id))).value
+
+
+async def transit(check: Checks) -> Decimal:
+    amounts = await LedgerEntry.filter(system_account=SystemAccount.transit).using_db(
+        user_connection(check.owner_id)
+    ).values_list("amount", flat=True)
+    return sum(amounts, Decimal(0))
+
+
+async def phases(check: Checks, intent: TransferIntent) -> set[TransferStep]:
+    return set(await TransferPhase.filter(intent_id=intent.id).using_db(user_connection(check.owner_id)).values_list(
+        "phase", flat=True
+    ))
+
+
+async def crash(*args, **kwargs):
+    raise RuntimeError("сбой процесса")
+
+
+async def test_transfer_between_shards(checks):
+    check_from, check_to = checks
+    transfer = await transfer_between_shards(check_from, check_to, Decimal(30))
+    assert (await balance(check_from), await balance(check_to)) == (Decimal(70), Decimal(30))
+    assert await transit(check_from) + await transit(check_to) == 0
+    intent = await TransferIntent.get()
+    assert intent.state == TransferState.committed
+    assert intent.transfer_id == transfer.id
+    assert await Transfers.filter(id=transfer.id).using_db(user_connection(check_from.owner_id)).exists()
+
+
+async def test_closed_recipient_aborts(checks):
+    check_from, check_to = checks
+    await Checks.filter(id=check_to.id).using_db(user_connection(check_to.owner_id)).update(is_open=False)
+    with pytest.raises(RecipientUnavailable):
+        await transfer_between_shards(check_from, check_to, Decimal(30))
+    assert await balance(check_from) == Decimal(100)
+    assert await transit(check_from) == 0
+    assert (await TransferIntent.get()).state == TransferState.aborted
+
+
+async def test_recovery_from_started(checks, monkeypatch):
+    check_from, check_to = checks
+    # сбой после подготовки, до решения
+    with monkeypatch.context() as patch, pytest.raises(RuntimeError):
+        patch.setattr(twophase, "_decide", crash)
+        await transfer_between_shards(check_from, check_to, Decimal(30))
+    assert await balance(check_from) == Decimal(70)
+
+    assert await recover_transfers(0) == 1
+    assert (await TransferIntent.get()).state == TransferState.aborted
+    assert (await balance(check_from), await balance(check_to)) == (Decimal(100), Decimal(0))
+    assert await transit(check_from) == 0
+
+
+async def test_recovery_from_committing(checks, monkeypatch):
+    check_from, check_to = checks
+    # сбой после решения, до шагов фиксации
+    with monkeypatch.context() as patch, pytest.raises(RuntimeError):
+        patch.setattr(twophase, "_commit", crash)
+        await transfer_between_shards(check_from, check_to, Decimal(30))
+    assert (await TransferIntent.get()).state == TransferState.committing
+
+    assert await recover_transfers(0) == 1
+    intent = await TransferIntent.get()
+    assert intent.state == TransferState.committed
+    assert (await balance(check_from), await balance(check_to)) == (Decimal(70), Decimal(30))
+    assert await Transfers.filter(id=intent.transfer_id).using_db(user_connection(check_from.owner_id)).exists()
+
+
+async def test_commit_after_recovery_returns_transfer(checks, monkeypatch):
+    check_from, check_to = checks
+    with monkeypatch.context() as patch, pytest.raises(RuntimeError):
+        patch.setattr(twophase, "_commit", crash)
+        await transfer_between_shards(check_from, check_to, Decimal(30))
+    await recover_transfers(0)
+
+    # исходный запрос доходит до фиксации после восстановления: шаги уже выполнены
+    intent = await TransferIntent.get()
+    transfer = await twophase._commit(intent)
+    assert transfer.id == intent.transfer_id
+    assert await balance(check_to) == Decimal(30)
+
+
+async def test_late_prepare_after_abort(checks):
+    check_from, check_to = checks
+    intent = await TransferIntent.create(
+        user_from_id=check_from.owner_id,
+        user_to_id=check_to.owner_id,
+        check_from_id=check_from.id,
+        check_to_id=check_to.id,
+        currency_type=CurrencyType.RUB,
+        value=Decimal(30),
+    )
+    # восстановление откатило перевод, пока подготовка ещё не дошла до шарда отправителя
+    await recover_transfers(0)
+    assert TransferStep.abort in await phases(check_from, intent)
+
+    with pytest.raises(TransferAborted):
+        await twophase._prepare(intent)
+    assert await balance(check_from) == Decimal(100)
+    assert await transit(check_from) == 0
+    assert TransferStep.prepare not in await phases(check_from, intent)
+
+
+async def test_late_prepare_after_abort_decision(checks):
+    check_from, check_to = checks
+    intent = await TransferIntent.create(
+        user_from_id=check_from.owner_id,
+        user_to_id=check_to.owner_id,
+        check_from_id=check_from.id,
+        check_to_id=check_to.id,
+        currency_type=CurrencyType.RUB,
+        value=Decimal(30),
+        state=TransferState.aborting,
+    )
+    with pytest.raises(TransferAborted):
+        await twophase._prepare(intent)
+    assert await balance(check_from) == Decimal(100)
+
+
+async def test_concurrent_step_is_already_done(checks, monkeypatch):
+    check_from, check_to = checks
+    with monkeypatch.context() as patch, pytest.raises(RuntimeError):
+        patch.setattr(twophase, "_commit", crash)
+        await transfer_between_shards(check_from, check_to, Decimal(30))
+    await recover_transfers(0)
+
+    # проверка отметки не увидела шаг восстановления: вставка нарушает уникальность
+    done = twophase._done
+    raced = []
+
+    async def racing(intent, step, connection):
+        if not raced:
+            raced.append(step)
+            return False
+        return await done(intent, step, connection)
+
+    monkeypatch.setattr(twophase, "_done", racing)
+    intent = await TransferIntent.get()
+    transfer = await twophase._commit(intent)
+    assert raced == [TransferStep.commit]
+    assert transfer.id == intent.transfer_id
+    assert (await balance(check_from), await balance(check_to)) == (Decimal(70), Decimal(30))
@@ -0,0 +1,123 @@
+import warnings
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from .timeseries import load_series
+
+# дней в году для годовой волатильности (курсы публикуются ежедневно)
+DAYS_PER_YEAR = 365
+
+
+def build_matrix(
+        series: dict[str, list[tuple[date, Decimal]]], start: date, end: date
+) -> tuple[list[str], np.ndarray]:
+    """
+    Матрица курсов (валюты x дни); пропуски заполняются ближайшим известным курсом
+    """
+    symbols = list(series)
+    days = (end - start).days + 1
+    matrix = np.full((len(symbols), days), np.nan)
+    for row, symbol in enumerate(symbols):
+        points = series[symbol]
+        if not points:
+            continue
+        columns = np.fromiter(((day - start).days for day, _ in points), dtype=np.int64, count=len(points))
+        values = np.fromiter((float(rate) for _, rate in points), dtype=np.float64, count=len(points))
+        matrix[row, columns] = values
+    return symbols, fill_gaps(matrix)
+
+
+def fill_gaps(matrix: np.ndarray) -> np.ndarray:
+    """
+    Заполнение пропусков вперёд, а в начале ряда - назад
+    """
+    valid = ~np.isnan(matrix)
+    index = np.where(valid, np.arange(matrix.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    filled = np.take_along_axis(matrix, index, axis=1)
+
+    # до первого известного значения подставляем первое известное
+    first = np.argmax(valid, axis=1)
+    head = np.take_along_axis(matrix, first[:, None], axis=1)
+    leading = np.arange(matrix.shape[1]) < first[:, None]
+    return np.where(leading, head, filled)
+
+
+def compute_analytics(matrix: np.ndarray, windows: list[int], correlation: bool = True) -> dict:
+    """
+    Все показатели по всем валютам за один векторный проход.
+    Скользящие средние - ряды (валюты x дни): i-е значение - среднее за window дней, заканчивая днём window - 1 + i
+    """
+    # ряды без данных дают NaN в показателях, а не предупреждения
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        returns = np.diff(np.log(matrix), axis=1)
+        if returns.shape[1] > 1:
+            daily_volatility = np.nanstd(returns, axis=1, ddof=1)
+        else:
+            daily_volatility = np.full(len(matrix), np.nan)
+        first, last = matrix[:, 0], matrix[:, -1]
+        result = {
+            "min": np.nanmin(matrix, axis=1),
+            "max": np.nanmax(matrix, axis=1),
+            "mean": np.nanmean(matrix, axis=1),
+            "start_rate": first,
+            "end_rate": last,
+            "change_pct": (last - first) / first * 100,
+            "volatility": daily_volatility * np.sqrt(DAYS_PER_YEAR),
+        }
+
+        cumulative = np.cumsum(np.pad(matrix, ((0, 0), (1, 0))), axis=1)
+        moving_averages = {}
+        for window in windows:
+            if 0 < window <= matrix.shape[1]:
+                moving_averages[window] = (cumulative[:, window:] - cumulative[:, :-window]) / window
+            else:
+                moving_averages[window] = np.empty((len(matrix), 0))
+
+        corr = np.corrcoef(returns) if correlation and returns.shape[1] > 1 else None
+    return {"stats": result, "moving_averages": moving_averages, "correlation": corr}
+
+
+def _to_json(values: np.ndarray) -> list[float | None]:
+    return [None if not np.isfinite(value) else round(float(value), 6) for value in values]
+
+
+async def rate_analytics(
+        base: str, symbols: list[str], start: date, end: date, windows: list[int], correlation: bool = True
+) -> dict:
+    """
+    Аналитика курсов: волатильность, минимум/максимум, скользящие средние, корреляции
+    """
+    end = min(end, date.today())
+    series = await load_series(base, symbols, start, end)
+    names, matrix = build_matrix(series, start, end)
+    computed = compute_analytics(matrix, windows, correlation)
+
+    columns = {key: _to_json(values) for key, values in computed["stats"].items()}
+    stats = {name: {key: values[row] for key, values in columns.items()} for row, name in enumerate(names)}
+    for window, moving in computed["moving_averages"].items():
+        for row, name in enumerate(names):
+            stats[name][f"ma_{window}"] = _to_json(moving[row])
+    response = {
+        "success": True,
+        "base": base,
+        "start_date": str(start),
+        "end_date": str(end),
+        "days": matrix.shape[1],
+        "rates": stats,
+        # дата первого значения ряда ma_{window}
+        "moving_average_start": {
+            f"ma_{window}": str(start + timedelta(days=window - 1))
+            for window, moving in computed["moving_averages"].items() if moving.shape[1]
+        },
+    }
+    if computed["correlation"] is not None:
+        corr = np.atleast_2d(computed["correlation"])
+        response["correlation"] = {
+            "symbols": names,
+            "matrix": [_to_json(row) for row in corr],
+        }
+    return response
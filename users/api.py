@@ -1,41 +1,163 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 
-from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from httpx import ReadTimeout
 from pydantic.types import Decimal
 from tortoise.contrib.fastapi import HTTPNotFoundError
-from tortoise.transactions import in_transaction
+from tortoise.expressions import Q
 from tortoise.exceptions import OperationalError
 
 from .models import (User_Pydantic, Users, Checks, Transfers, TransfersIn_Pydantic,
                      HistoryConvert_Pydantic, HistoryConvert)
-from .schemas import UserRegister, UserApproved, UserBlocked, Token, UserUpdate
-from .currency import CurrencyUpdate, CreateCheck, CurrencyType, ConverterCurrency, CurrencyList, CurrencyPrice
-from .converter import currency_converter, currency_list, currency_fluctuation
+from .schemas import UserRegister, UserApproved, UserBlocked, Token, UserUpdate, TokenClaims, RefreshRequest
+from .currency import (CurrencyUpdate, CreateCheck, CurrencyType, ConverterCurrency, CurrencyList, CurrencyPrice,
+                       PriceQuery, TransferDirection, TransferItem)
+from .converter import (currency_converter, currency_list, currency_prices, coalescing_stats, cache_stats,
+                        resilience_stats)
+from .timeseries import rate_fluctuation
+from .analytics import rate_analytics
+from .resilience import DeadlineExceeded, UpstreamRejected, UpstreamUnavailable
+from .quotes import QuoteUnavailable, quote_store
+from .principals import Principal, principal_cache
+from .tokens import revocations, token_cache
+from .ratelimit import rate_limit, store as rate_limit_store
+from .balances import InsufficientFunds, book_convert, book_refill, book_transfer, book_unfill, to_cents
+from .pagination import PageParams
+from .export import MEDIA_TYPES, ExportFormat, ExportKind, export_stream
+from .ledger import ledger_balance, ledger_jobs
+from .db import read_connection, run_write
+from .shards import (data_name, fan_out, merge_pages, shard_name, sharding_enabled, user_connection,
+                     user_read_connection)
+from .archive import archive_jobs, cold_history, merge_history
+from .twophase import RecipientUnavailable, TransferAborted, transfer_between_shards, transfer_recovery
 
-from .hashing import get_hasher
-from .security import authenticate_user, get_current_active_user, signJWT
+from .hashing import hash_password
+from .security import (authenticate_user, get_current_active_user, get_active_claims, revoke_user_tokens, signJWT,
+                       issue_refresh_token, rotate_refresh_token, revoke_refresh_token, get_token_claims,
+                       revoke_access_token)
+from config import currency_api_conf, pagination_config
 
 
 users_router = APIRouter(prefix="/users", tags=["users"])
 
 
+def cents(amount: Decimal) -> Decimal:
+    """
+    Сумма операции со счётом: не точнее копейки, как хранятся остатки
+    """
+    if amount != to_cents(amount):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Сумма указывается не точнее 0.01")
+    return to_cents(amount)
+
+
 @users_router.get("/currency_types",
                   status_code=200,
                   response_model=CurrencyList,
                   )
-async def get_currency_types(current_user: Users = Depends(get_current_active_user)):
+async def get_currency_types(claims: TokenClaims = Depends(get_active_claims)):
     """
     Расшифровка кодов валют
     """
     try:
         currencies = await currency_list()
         return CurrencyList(currencies=currencies.get('symbols'))
-    except ReadTimeout:
+    except (ReadTimeout, DeadlineExceeded):
         raise HTTPException(
             status_code=status.HTTP_408_REQUEST_TIMEOUT,
         )
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except UpstreamRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@users_router.get("/upstream_stats", status_code=200)
+async def get_upstream_stats(current_user: Principal = Depends(get_current_active_user)):
+    """
+    Статистика запросов к API курсов (только для админа)
+    """
+    if current_user.is_superuser:
+        return {
+            "coalescing": coalescing_stats(),
+            "caches": cache_stats(),
+            "quotes": quote_store.stats(),
+            **resilience_stats(),
+        }
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN, detail='У вас недостаточно прав для данного действия'
+    )
+
+
+@users_router.get("/auth_stats", status_code=200)
+async def get_auth_stats(current_user: Principal = Depends(get_current_active_user)):
+    """
+    Статистика кэшей авторизации (только для админа)
+    """
+    if current_user.is_superuser:
+        return {
+            "principals": principal_cache.stats(),
+            "tokens": token_cache.stats(),
+            "revocations": revocations.stats(),
+            "rate_limit": rate_limit_store.stats(),
+        }
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN, detail='У вас недостаточно прав для данного действия'
+    )
+
+
+@users_router.get("/ledger/balance/{check_id}", status_code=200)
+async def get_ledger_balance(
+        check_id: int,
+        at: datetime | None = None,
+        user_id: int | None = None,
+        current_user: Principal = Depends(get_current_active_user)
+):
+    """
+    Остаток счёта по журналу на момент at (по умолчанию - сейчас), для админа.
+    При шардировании номера счетов свои на каждом шарде: нужен владелец user_id
+    """
+    if current_user.is_superuser:
+        if user_id is None and sharding_enabled():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Укажите владельца счёта user_id")
+        connection = user_connection(user_id) if user_id is not None else None
+        check = await Checks.get_or_none(id=check_id, using_db=connection)
+        if not check or user_id is not None and check.owner_id != user_id:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Счёт не найден")
+        return {
+            "check_id": check_id,
+            "currency_type": check.currency_type,
+            "at": at,
+            "balance": await ledger_balance(check_id, at=at, connection=connection),
+        }
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN, detail='У вас недостаточно прав для данного действия'
+    )
+
+
+@users_router.get("/ledger_stats", status_code=200)
+async def get_ledger_stats(current_user: Principal = Depends(get_current_active_user)):
+    """
+    Снимки остатков, последняя сверка журнала и восстановление переводов между шардами (только для админа)
+    """
+    if current_user.is_superuser:
+        return {**ledger_jobs.stats(), "transfer_recovery": transfer_recovery.stats()}
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN, detail='У вас недостаточно прав для данного действия'
+    )
+
+
+@users_router.get("/archive_stats", status_code=200)
+async def get_archive_stats(current_user: Principal = Depends(get_current_active_user)):
+    """
+    Перенос конвертаций в архив и сегменты по базам (только для админа)
+    """
+    if current_user.is_superuser:
+        return archive_jobs.stats()
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN, detail='У вас недостаточно прав для данного действия'
+    )
 
 
 @users_router.get("/histories",
@@ -43,13 +165,37 @@ async def get_currency_types(current_user: Users = Depends(get_current_active_us
                   response_model=list[HistoryConvert_Pydantic] | HistoryConvert_Pydantic,
                   responses={404: {"model": HTTPNotFoundError}}
                   )
-async def get_history(current_user: Users = Depends(get_current_active_user)):
+async def get_history(
+        response: Response,
+        currency_from: CurrencyType | None = None,
+        currency_to: CurrencyType | None = None,
+        user_id: int | None = None,
+        page: PageParams = Depends(),
+        current_user: Principal = Depends(get_current_active_user)
+):
     """
-    История всех конвертаций (только для админа)
+    История всех конвертаций (только для админа), по страницам; при шардировании - со всех шардов
     """
     if current_user.is_superuser:
-        histories = await HistoryConvert_Pydantic.from_queryset(HistoryConvert.all())
-        if histories:
+        queryset = HistoryConvert.all()
+        if user_id is not None:
+            queryset = queryset.filter(user_id_id=user_id)
+        if currency_from:
+            queryset = queryset.filter(currency_type_from=currency_from)
+        if currency_to:
+            queryset = queryset.filter(currency_type_to=currency_to)
+
+        async def shard_page(connection):
+            hot = await HistoryConvert_Pydantic.from_queryset(page.apply(queryset.using_db(connection)))
+            cold = await cold_history(data_name(connection), page, user_id, currency_from, currency_to)
+            return merge_history(hot, cold, page.limit)
+
+        if user_id is not None:
+            rows = await shard_page(user_read_connection(user_id))
+        else:
+            rows = merge_pages(await fan_out(shard_page), page.limit)
+        histories = page.page(rows, response)
+        if histories or page.cursor:
             return histories
         raise HTTPException(
             status_code=status.HTTP_200_OK, detail='Пока конвертаций не было'
@@ -64,34 +210,163 @@ async def get_history(current_user: Users = Depends(get_current_active_user)):
                   response_model=list[HistoryConvert_Pydantic] | HistoryConvert_Pydantic,
                   responses={404: {"model": HTTPNotFoundError}}
                   )
-async def get_user_history(current_user: Users = Depends(get_current_active_user)):
+async def get_user_history(
+        response: Response,
+        currency_from: CurrencyType | None = None,
+        currency_to: CurrencyType | None = None,
+        page: PageParams = Depends(),
+        current_user: Principal = Depends(get_current_active_user)
+):
     """
-    История всех конвертаций пользователя
+    История всех конвертаций пользователя, по страницам: из базы и из архивных сегментов
     """
-    history = await HistoryConvert_Pydantic.from_queryset(HistoryConvert.filter(user_id=current_user.id))
-    if history:
+    queryset = HistoryConvert.filter(user_id_id=current_user.id).using_db(user_read_connection(current_user.id))
+    if currency_from:
+        queryset = queryset.filter(currency_type_from=currency_from)
+    if currency_to:
+        queryset = queryset.filter(currency_type_to=currency_to)
+    hot = await HistoryConvert_Pydantic.from_queryset(page.apply(queryset))
+    # архив читается после базы: перенос публикует сегмент раньше, чем удаляет строки
+    cold = await cold_history(shard_name(current_user.id), page, current_user.id, currency_from, currency_to)
+    history = page.page(merge_history(hot, cold, page.limit), response)
+    if history or page.cursor:
         return history
     raise HTTPException(
         status_code=status.HTTP_200_OK, detail="У вас не было ещё ковертаций"
     )
 
 
+@users_router.get("/transfers",
+                  status_code=200,
+                  response_model=list[TransferItem],
+                  )
+async def get_my_transfers(
+        response: Response,
+        direction: TransferDirection | None = None,
+        counterparty: int | None = None,
+        currency: CurrencyType | None = None,
+        page: PageParams = Depends(),
+        current_user: Principal = Depends(get_current_active_user)
+):
+    """
+    Переводы пользователя (входящие, исходящие или все), по страницам.
+    Перевод хранится на шарде отправителя: исходящие - с шарда пользователя, входящие - со всех шардов
+    """
+    if direction == TransferDirection.incoming:
+        queryset = Transfers.filter(user_to_id=current_user.id)
+        if counterparty is not None:
+            queryset = queryset.filter(user_from_id=counterparty)
+    elif direction == TransferDirection.outgoing:
+        queryset = Transfers.filter(user_from_id=current_user.id)
+        if counterparty is not None:
+            queryset = queryset.filter(user_to_id=counterparty)
+    else:
+        queryset = Transfers.filter(Q(user_from_id=current_user.id) | Q(user_to_id=current_user.id))
+        if counterparty is not None:
+            queryset = queryset.filter(Q(user_from_id=counterparty) | Q(user_to_id=counterparty))
+    if currency:
+        queryset = queryset.filter(currency_type=currency)
+
+    async def shard_page(connection):
+        rows = await page.apply(queryset.using_db(connection)).values_list(*TransferItem.FIELDS)
+        return [TransferItem.from_row(row) for row in rows]
+
+    if direction == TransferDirection.outgoing:
+        rows = await shard_page(user_read_connection(current_user.id))
+    else:
+        rows = merge_pages(await fan_out(shard_page), page.limit)
+    return page.page(rows, response)
+
+
+@users_router.get("/transfers/all",
+                  status_code=200,
+                  response_model=list[TransferItem],
+                  )
+async def get_transfers(
+        response: Response,
+        user_from: int | None = None,
+        user_to: int | None = None,
+        currency: CurrencyType | None = None,
+        page: PageParams = Depends(),
+        current_user: Principal = Depends(get_current_active_user)
+):
+    """
+    Все переводы между пользователями (только для админа), по страницам; при шардировании - со всех шардов
+    """
+    if current_user.is_superuser:
+        queryset = Transfers.all()
+        if user_from is not None:
+            queryset = queryset.filter(user_from_id=user_from)
+        if user_to is not None:
+            queryset = queryset.filter(user_to_id=user_to)
+        if currency:
+            queryset = queryset.filter(currency_type=currency)
+
+        async def shard_page(connection):
+            rows = await page.apply(queryset.using_db(connection)).values_list(*TransferItem.FIELDS)
+            return [TransferItem.from_row(row) for row in rows]
+
+        if user_from is not None:
+            rows = await shard_page(user_read_connection(user_from))
+        else:
+            rows = merge_pages(await fan_out(shard_page), page.limit)
+        return page.page(rows, response)
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN, detail='У вас недостаточно прав для данного действия'
+    )
+
+
+@users_router.get("/export/{kind}", status_code=200)
+async def export_data(
+        kind: ExportKind,
+        export_format: ExportFormat = Query(ExportFormat.ndjson, alias="format"),
+        user_id: int | None = None,
+        date_from: date | None = None,
+        date_to: date | None = None,
+        gzip: bool = False,
+        current_user: Principal = Depends(get_current_active_user)
+):
+    """
+    Потоковая выгрузка конвертаций или переводов в NDJSON/CSV (только для админа)
+    """
+    if current_user.is_superuser:
+        headers = {"Content-Disposition": f'attachment; filename="{kind.value}.{export_format.value}"'}
+        if gzip:
+            headers["Content-Encoding"] = "gzip"
+        return StreamingResponse(
+            export_stream(
+                kind,
+                export_format,
+                chunk_size=pagination_config["export_chunk_size"],
+                compress=gzip,
+                user_id=user_id,
+                date_from=date_from,
+                date_to=date_to,
+            ),
+            media_type=MEDIA_TYPES[export_format],
+            headers=headers,
+        )
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN, detail='У вас недостаточно прав для данного действия'
+    )
+
+
 @users_router.get("/checks/{user_id}",
                   status_code=200,
                   response_model=list[CreateCheck] | CreateCheck,
                   responses={404: {"model": HTTPNotFoundError}}
                   )
-async def get_user_checks(user_id: int, current_user: Users = Depends(get_current_active_user)):
+async def get_user_checks(user_id: int, current_user: Principal = Depends(get_current_active_user)):
     """
     Счета пользователя (для админа)
     """
     if current_user.is_superuser:
-        check = await Checks.get_or_none(user_id=user_id)
-        if not check:
+        checks = await Checks.filter(owner_id=user_id).using_db(user_read_connection(user_id))
+        if not checks:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Нет пользователя с такими счетами"
             )
-        return check
+        return checks
     raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN, detail='У вас недостаточно прав для данного действия'
     )
@@ -102,11 +377,11 @@ async def get_user_checks(user_id: int, current_user: Users = Depends(get_curren
                   response_model=list[CreateCheck] | CreateCheck,
                   responses={404: {"model": HTTPNotFoundError}}
                   )
-async def get_my_checks(current_user: Users = Depends(get_current_active_user)):
+async def get_my_checks(current_user: Principal = Depends(get_current_active_user)):
     """
     Счета пользователя
     """
-    return await Checks.filter(user_id=current_user.id)
+    return await Checks.filter(owner_id=current_user.id).using_db(user_read_connection(current_user.id))
 
 
 @users_router.get("/unapproved",
@@ -114,13 +389,16 @@ async def get_my_checks(current_user: Users = Depends(get_current_active_user)):
                   response_model=list[UserApproved] | UserApproved,
                   responses={404: {"model": HTTPNotFoundError}}
                   )
-async def get_unapproved_users(current_user: Users = Depends(get_current_active_user)):
+async def get_unapproved_users(
+        response: Response, page: PageParams = Depends(), current_user: Principal = Depends(get_current_active_user)
+):
     """
-    Список неподтверждённых пользователей (для админа)
+    Список неподтверждённых пользователей (для админа), по страницам
     """
     if current_user.is_superuser:
-        users_list = await Users.filter(is_approved=False, is_superuser=False).all()
-        if users_list:
+        queryset = Users.filter(is_approved=False, is_superuser=False).using_db(read_connection())
+        users_list = page.page(await page.apply(queryset), response)
+        if users_list or page.cursor:
             return users_list
         raise HTTPException(
             status_code=status.HTTP_200_OK, detail="Пока нет неподтверждённых пользователей"
@@ -135,13 +413,16 @@ async def get_unapproved_users(current_user: Users = Depends(get_current_active_
                   response_model=list[UserApproved] | UserApproved,
                   responses={404: {"model": HTTPNotFoundError}}
                   )
-async def get_approved_users(current_user: Users = Depends(get_current_active_user)):
+async def get_approved_users(
+        response: Response, page: PageParams = Depends(), current_user: Principal = Depends(get_current_active_user)
+):
     """
-    Список подтверждённых пользователей (для админа)
+    Список подтверждённых пользователей (для админа), по страницам
     """
     if current_user.is_superuser:
-        users_list = await Users.filter(is_approved=True, is_superuser=False).all()
-        if users_list:
+        queryset = Users.filter(is_approved=True, is_superuser=False).using_db(read_connection())
+        users_list = page.page(await page.apply(queryset), response)
+        if users_list or page.cursor:
             return users_list
         raise HTTPException(
             status_code=status.HTTP_200_OK, detail="Пока нет подтверждённых пользователей"
@@ -151,7 +432,7 @@ async def get_approved_users(current_user: Users = Depends(get_current_active_us
     )
 
 
-@users_router.post('/token', response_model=Token)
+@users_router.post('/token', response_model=Token, dependencies=[Depends(rate_limit("token"))])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     user = await authenticate_user(form_data.username, form_data.password)
     if not user:
@@ -160,10 +441,48 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = signJWT(username=form_data.username)
+    access_token = signJWT(user)
+    access_token["refresh_token"] = await issue_refresh_token(user)
     return access_token
 
 
+@users_router.post('/token/refresh', response_model=Token, dependencies=[Depends(rate_limit("token_refresh"))])
+async def refresh_access_token(data: RefreshRequest):
+    """
+    Новый токен доступа по токену обновления (без проверки пароля)
+    """
+    rotated = await rotate_refresh_token(data.refresh_token)
+    if not rotated:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user, refresh_token = rotated
+    access_token = signJWT(user)
+    access_token["refresh_token"] = refresh_token
+    return access_token
+
+
+@users_router.post('/token/revoke', status_code=204)
+async def revoke_token(data: RefreshRequest):
+    """
+    Отзыв токена обновления (выход)
+    """
+    if not await revoke_refresh_token(data.refresh_token):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Токен не найден")
+
+
+@users_router.post('/logout', status_code=204)
+async def logout(data: RefreshRequest | None = None, claims: TokenClaims = Depends(get_token_claims)):
+    """
+    Выход: отзыв текущего токена доступа и, если передан, цепочки токенов обновления
+    """
+    revoke_access_token(claims)
+    if data is not None:
+        await revoke_refresh_token(data.refresh_token)
+
+
 @users_router.post("/register",
                    status_code=201,
                    response_model=User_Pydantic,
@@ -173,18 +492,16 @@ async def user_register(user: UserRegister):
     """
     Регистрация пользователя
     """
-    password_hash = get_hasher()
-    user.password = password_hash.hash(user.password)
     _user = await Users.get_or_none(username=user.username)
     if _user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail=f"Пользователь {_user.username} уже существует"
         )
+    user.password = await hash_password(user.password)
     new_user = await Users.create(**user.dict(exclude_unset=True))
 
     # создание нового счёта
-    new_check = await Checks.create()
-    await new_check.user_id.add(new_user)
+    await Checks.create(owner=new_user, using_db=user_connection(new_user.id))
     return await User_Pydantic.from_tortoise_orm(new_user)
 
 
@@ -193,11 +510,13 @@ async def user_register(user: UserRegister):
                    response_model=CreateCheck,
                    responses={404: {"model": HTTPNotFoundError}}
                    )
-async def create_check(currency: CurrencyType, current_user: Users = Depends(get_current_active_user)):
+async def create_check(currency: CurrencyType, current_user: Principal = Depends(get_current_active_user)):
     """
     Регистрация нового счёта
     """
-    is_check = await Checks.get_or_none(user_id=current_user.id, currency_type=currency)
+    is_check = await Checks.get_or_none(
+        owner_id=current_user.id, currency_type=currency, using_db=user_connection(current_user.id)
+    )
 
     if is_check:
         raise HTTPException(
@@ -213,82 +532,179 @@ async def create_check(currency: CurrencyType, current_user: Users = Depends(get
         )
 
     # создание нового счёта
-    new_check = await Checks.create(currency_type=currency)
-    await new_check.user_id.add(current_user)
-    await new_check.save()
+    new_check = await Checks.create(
+        owner_id=current_user.id, currency_type=currency, using_db=user_connection(current_user.id)
+    )
     return CreateCheck.from_orm(new_check)
 
 
 @users_router.get("/get_price",
                   status_code=200,
                   response_model=CurrencyPrice,
+                  dependencies=[Depends(rate_limit("get_price"))],
                   )
 async def get_price(
         type_from: CurrencyType,
         type_to: CurrencyType,
-        value: Decimal,
-        current_user: Users = Depends(get_current_active_user)
+        value: Decimal = Query(gt=0),
+        lock: bool = False,
+        claims: TokenClaims = Depends(get_active_claims)
 ):
     """
-    Узнать стоимость конвертации (курс)
+    Узнать стоимость конвертации (курс); lock - зафиксировать курс для /convert
     """
     try:
         convert = await currency_converter(
             currency_from=type_from.name, currency_to=type_to.name, value=str(value)
         )
-    except ReadTimeout:
+    except (ReadTimeout, DeadlineExceeded):
         raise HTTPException(
             status_code=status.HTTP_408_REQUEST_TIMEOUT,
         )
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except UpstreamRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     result = dict(type_from=type_from.name, type_to=type_to.name, value=value, price=convert.get('result'))
+    if lock:
+        quote = quote_store.issue(
+            user_id=claims.uid,
+            type_from=type_from.name,
+            type_to=type_to.name,
+            value=value,
+            price=Decimal(convert.get('result')),
+        )
+        result.update(quote_id=quote.id, expires_at=quote.expires_at)
     return CurrencyPrice(**result)
 
 
+@users_router.post("/get_prices",
+                   status_code=200,
+                   response_model=list[CurrencyPrice],
+                   dependencies=[Depends(rate_limit("get_prices"))],
+                   )
+async def get_prices(items: list[PriceQuery], claims: TokenClaims = Depends(get_active_claims)):
+    """
+    Узнать стоимость конвертации для нескольких пар сразу (по одному снимку курсов)
+    """
+    if len(items) > currency_api_conf.get('batch_max_items'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Не больше {currency_api_conf.get('batch_max_items')} пар в одном запросе"
+        )
+    try:
+        prices = await currency_prices(
+            [(item.type_from.name, item.type_to.name, item.value) for item in items]
+        )
+    except (ReadTimeout, DeadlineExceeded):
+        raise HTTPException(
+            status_code=status.HTTP_408_REQUEST_TIMEOUT,
+        )
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except UpstreamRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return [
+        CurrencyPrice(type_from=item.type_from.name, type_to=item.type_to.name, value=item.value, price=price)
+        for item, price in zip(items, prices)
+    ]
+
+
 @users_router.get("/get_fluctuation", status_code=200)
 async def get_fluctuation(
         base: CurrencyType, symbols: list[CurrencyType] = Query(...),
         start_date: date = date.today() - timedelta(days=365), end_date: date = date.today(),
-        current_user: Users = Depends(get_current_active_user)
+        claims: TokenClaims = Depends(get_active_claims)
 ):
     """
     Узнать колебания валют (по умолчанию за последний год)
     """
+    if start_date > end_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Дата начала позже даты окончания"
+        )
     try:
-        convert = await currency_fluctuation(
-            start_date=str(start_date),
-            end_date=str(end_date),
+        convert = await rate_fluctuation(
             base=base.name,
-            symbols=','.join(list(map(lambda symbol: symbol.name, symbols)))
+            symbols=list(map(lambda symbol: symbol.name, symbols)),
+            start=start_date,
+            end=end_date,
         )
-    except ReadTimeout:
+    except (ReadTimeout, DeadlineExceeded):
         raise HTTPException(
             status_code=status.HTTP_408_REQUEST_TIMEOUT,
         )
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except UpstreamRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     return convert
 
 
+@users_router.get("/get_analytics", status_code=200)
+async def get_analytics(
+        base: CurrencyType, symbols: list[CurrencyType] = Query(...),
+        start_date: date = date.today() - timedelta(days=365), end_date: date = date.today(),
+        windows: list[int] = Query([7, 30]), correlation: bool = True,
+        claims: TokenClaims = Depends(get_active_claims)
+):
+    """
+    Аналитика курсов: волатильность, минимум/максимум, скользящие средние и корреляции
+    """
+    if start_date > end_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Дата начала позже даты окончания"
+        )
+    try:
+        analytics = await rate_analytics(
+            base=base.name,
+            symbols=list(map(lambda symbol: symbol.name, symbols)),
+            start=start_date,
+            end=end_date,
+            windows=windows,
+            correlation=correlation,
+        )
+    except (ReadTimeout, DeadlineExceeded):
+        raise HTTPException(
+            status_code=status.HTTP_408_REQUEST_TIMEOUT,
+        )
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except UpstreamRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return analytics
+
+
 @users_router.put("/convert",
                   status_code=200,
                   response_model=list[ConverterCurrency] | ConverterCurrency,
+                  dependencies=[Depends(rate_limit("convert"))],
                   )
 async def convert_currency(
         type_from: CurrencyType,
         type_to: CurrencyType,
-        value: Decimal,
-        current_user: Users = Depends(get_current_active_user)
+        value: Decimal = Query(gt=0),
+        quote_id: str | None = None,
+        current_user: Principal = Depends(get_current_active_user)
 ):
     """
     Конвертация валют
     """
+    value = cents(value)
     if type_from == type_to:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Вы не можете конвертировать {type_from.name} в {type_to.name}"
         )
 
-    is_check_from = await Checks.get_or_none(user_id=current_user.id, currency_type=type_from, is_open=True)
+    connection = user_connection(current_user.id)
+    is_check_from = await Checks.get_or_none(
+        owner_id=current_user.id, currency_type=type_from, is_open=True, using_db=connection
+    )
     if not is_check_from:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -301,40 +717,75 @@ async def convert_currency(
             detail=f"У вас недостаточно средств на {type_from.name} счёту"
         )
 
-    is_check_to = await Checks.get_or_none(user_id=current_user.id, currency_type=type_to, is_open=True)
+    is_check_to = await Checks.get_or_none(
+        owner_id=current_user.id, currency_type=type_to, is_open=True, using_db=connection
+    )
     if not is_check_to:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"У вас нет {type_to.name} счёта или он закрыт"
         )
+
+    # конвертация по зафиксированному курсу без обращения к API
+    quote = None
+    if quote_id:
+        quote = quote_store.peek(quote_id, current_user.id)
+        if not quote:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Котировка не найдена или истекла"
+            )
+        if (quote.type_from, quote.type_to, quote.value) != (type_from.name, type_to.name, value):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Параметры конвертации не совпадают с котировкой"
+            )
+        convert = {"result": quote.price}
+    else:
+        try:
+            convert = await currency_converter(
+                currency_from=type_from.name, currency_to=type_to.name, value=str(value)
+            )
+        except (ReadTimeout, DeadlineExceeded):
+            raise HTTPException(
+                status_code=status.HTTP_408_REQUEST_TIMEOUT,
+            )
+        except UpstreamUnavailable as e:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+        except UpstreamRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+            )
+    # на счёт зачисляется и в историю пишется сумма с точностью счёта
+    converter_value = to_cents(Decimal(convert.get("result")))
+    if converter_value <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Сумма конвертации меньше 0.01")
     try:
-        convert = await currency_converter(
-            currency_from=type_from.name, currency_to=type_to.name, value=str(value)
-        )
-    except ReadTimeout:
-        raise HTTPException(
-            status_code=status.HTTP_408_REQUEST_TIMEOUT,
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
-        )
-    converter_value = Decimal(convert.get("result"))
-    is_check_from.value -= value
-    is_check_to.value += converter_value
-    try:
-        async with in_transaction() as connection:
-            await is_check_from.save(using_db=connection)
-            await is_check_to.save(using_db=connection)
+        async def write(connection):
+            await book_convert(connection, is_check_from, value, is_check_to, converter_value)
             await HistoryConvert.create(
-                user_id=current_user,
+                user_id_id=current_user.id,
                 currency_type_from=type_from,
                 currency_type_to=type_to,
                 value_from=value,
-                value_to=converter_value
+                value_to=converter_value,
+                using_db=connection
             )
-            return await Checks.filter(user_id=current_user.id).all()
+            return await Checks.filter(owner_id=current_user.id).using_db(connection).all()
+
+        if quote is None:
+            return await run_write(write, shard_name(current_user.id))
+        # котировка исполняется, только если конвертация записана
+        with quote_store.settle(quote):
+            return await run_write(write, shard_name(current_user.id))
 
+    except QuoteUnavailable:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Котировка не найдена или истекла")
+    except InsufficientFunds:
+        raise HTTPException(
+            status_code=status.HTTP_200_OK,
+            detail=f"У вас недостаточно средств на {type_from.name} счёту"
+        )
     except OperationalError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
@@ -345,11 +796,14 @@ async def convert_currency(
                     responses={404: {"model": HTTPNotFoundError}}
                     )
 async def user_refill(
-        amount: Decimal, currency: CurrencyType, current_user: Users = Depends(get_current_active_user)
+        currency: CurrencyType,
+        amount: Decimal = Query(gt=0),
+        current_user: Principal = Depends(get_current_active_user)
 ):
     """
     Пополнение баланса
     """
+    amount = cents(amount)
     if currency != CurrencyType.RUB:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -366,12 +820,17 @@ async def user_refill(
             detail=f"Пользователь {current_user.username} заблокирован"
         )
     # проверка существования счёта
-    check = await Checks.get_or_none(user_id=current_user.id, is_open=True, currency_type=currency.name)
+    check = await Checks.get_or_none(
+        owner_id=current_user.id, is_open=True, currency_type=currency.name, using_db=user_connection(current_user.id)
+    )
     if not check:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Открытые счета не найдены")
-    check.value += amount
-    await check.save()
-    return check
+
+    async def write(connection):
+        await book_refill(connection, check, amount)
+        return await Checks.get(id=check.id).using_db(connection)
+
+    return await run_write(write, shard_name(current_user.id))
 
 
 @users_router.patch("/approve/{user_id}",
@@ -379,7 +838,7 @@ async def user_refill(
                     response_model=UserApproved,
                     responses={404: {"model": HTTPNotFoundError}}
                     )
-async def user_approve(user_id: int, current_user: Users = Depends(get_current_active_user)):
+async def user_approve(user_id: int, current_user: Principal = Depends(get_current_active_user)):
     """
     Подтвержение пользователя администратором
     """
@@ -389,6 +848,7 @@ async def user_approve(user_id: int, current_user: Users = Depends(get_current_a
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Пользователь не найден или уже подтверждён"
             )
+        principal_cache.invalidate(user_id=user_id)
         user = await Users.get(id=user_id)
         return UserApproved.from_orm(user)
     raise HTTPException(
@@ -402,11 +862,14 @@ async def user_approve(user_id: int, current_user: Users = Depends(get_current_a
                     responses={404: {"model": HTTPNotFoundError}}
                     )
 async def user_unfill(
-        amount: Decimal, currency: CurrencyType, current_user: Users = Depends(get_current_active_user)
+        currency: CurrencyType,
+        amount: Decimal = Query(gt=0),
+        current_user: Principal = Depends(get_current_active_user)
 ):
     """
     Вывод средств со счёта
     """
+    amount = cents(amount)
     if currency != CurrencyType.RUB:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -423,18 +886,22 @@ async def user_unfill(
             detail=f"Пользователь {current_user.username} заблокирован"
         )
     # проверка существования счёта
-    check = await Checks.get_or_none(user_id=current_user.id, is_open=True, currency_type=currency.name)
+    check = await Checks.get_or_none(
+        owner_id=current_user.id, is_open=True, currency_type=currency.name, using_db=user_connection(current_user.id)
+    )
     if not check:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Открытый {currency.name} счёт не найден"
                             )
 
-    if amount > check.value:
-        raise HTTPException(status_code=status.HTTP_200_OK, detail=f"У нас недостаточно средств")
+    try:
+        async def write(connection):
+            await book_unfill(connection, check, amount)
+            return await Checks.get(id=check.id).using_db(connection)
 
-    check.value -= amount
-    await check.save()
-    return check
+        return await run_write(write, shard_name(current_user.id))
+    except InsufficientFunds:
+        raise HTTPException(status_code=status.HTTP_200_OK, detail=f"У нас недостаточно средств")
 
 
 @users_router.patch("/block/{user_id}",
@@ -442,7 +909,7 @@ async def user_unfill(
                     response_model=UserBlocked,
                     responses={404: {"model": HTTPNotFoundError}}
                     )
-async def user_block(user_id: int, current_user: Users = Depends(get_current_active_user)):
+async def user_block(user_id: int, current_user: Principal = Depends(get_current_active_user)):
     """
     Блокировка пользователя администратором
     """
@@ -452,6 +919,8 @@ async def user_block(user_id: int, current_user: Users = Depends(get_current_act
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail=f"Пользователь не найден или уже заблокирован"
             )
+        principal_cache.invalidate(user_id=user_id)
+        await revoke_user_tokens(user_id)
         user = await Users.get(id=user_id)
         return UserBlocked.from_orm(user)
     raise HTTPException(
@@ -465,11 +934,15 @@ async def user_block(user_id: int, current_user: Users = Depends(get_current_act
                     responses={404: {"model": HTTPNotFoundError}}
                     )
 async def create_transfer(
-        currency: CurrencyType, user_id: int, value: Decimal, current_user: Users = Depends(get_current_active_user)
+        currency: CurrencyType,
+        user_id: int,
+        value: Decimal = Query(gt=0),
+        current_user: Principal = Depends(get_current_active_user)
 ):
     """
     Перевод средств между пользователями
     """
+    value = cents(value)
     # проверка отправителя
     if not current_user.is_active and not current_user.is_approved:
         raise HTTPException(
@@ -485,48 +958,58 @@ async def create_transfer(
             detail=f"Получатель не найден, заблокирован или не подтверждён"
         )
 
-    if current_user == user_to:
+    if current_user.id == user_to.id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Вы не можете переводить средства самому себе"
         )
 
+    check_from = await Checks.get_or_none(
+        owner_id=current_user.id, is_open=True, currency_type=currency, using_db=user_connection(current_user.id)
+    )
+    if not check_from:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Открытый счёт {currency.name} отправителя не найден"
+        )
+    check_to = await Checks.get_or_none(
+        owner_id=user_to.id, is_open=True, currency_type=currency, using_db=user_connection(user_to.id)
+    )
+    if not check_to:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Открытый счёт {currency.name} получателя не найден"
+        )
+
     try:
-        async with in_transaction() as connection:
-            transfer = Transfers(
-                user_from=current_user,
+        async def write(connection):
+            await book_transfer(connection, check_from, check_to, value)
+            return await Transfers.create(
+                user_from_id=current_user.id,
                 user_to=user_to,
                 value=value,
-                currency_type=currency
-            )
-            check_from = await Checks.get_or_none(
-                user_id=current_user.id, is_open=True, currency_type=currency
-            )
-            if check_from.value < value:
-                raise HTTPException(
-                    status_code=status.HTTP_200_OK,
-                    detail=f"У вас недостаточно средствн на {currency.name} счёту"
-                )
-            if not check_from:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Открытый счёт {currency.name} отправителя не найден"
-                )
-            check_to = await Checks.get_or_none(
-                user_id=user_to.id, is_open=True, currency_type=currency
+                currency_type=currency,
+                using_db=connection
             )
-            if not check_to:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Открытый счёт {currency.name} получателя не найден"
-                )
-            check_to.value += value
-            check_from.value -= value
-            await transfer.save(using_db=connection)
-            await check_to.save()
-            await check_from.save()
-            return await TransfersIn_Pydantic.from_tortoise_orm(transfer)
 
+        if shard_name(current_user.id) == shard_name(user_to.id):
+            transfer = await run_write(write, shard_name(current_user.id))
+        else:
+            transfer = await transfer_between_shards(check_from, check_to, value)
+        return await TransfersIn_Pydantic.from_tortoise_orm(transfer)
+
+    except InsufficientFunds:
+        raise HTTPException(
+            status_code=status.HTTP_200_OK,
+            detail=f"У вас недостаточно средствн на {currency.name} счёту"
+        )
+    except RecipientUnavailable:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Открытый счёт {currency.name} получателя не найден"
+        )
+    except TransferAborted:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Перевод отменён, повторите попытку")
     except OperationalError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
@@ -535,11 +1018,11 @@ async def create_transfer(
                   response_model=User_Pydantic,
                   responses={404: {"model": HTTPNotFoundError}}
                   )
-async def get_me(current_user: Users = Depends(get_current_active_user)):
+async def get_me(current_user: Principal = Depends(get_current_active_user)):
     """
     Получить информацию о текущем пользователе
     """
-    return current_user
+    return await User_Pydantic.from_queryset_single(Users.get(id=current_user.id))
 
 
 @users_router.put("/update_profile",
@@ -547,11 +1030,12 @@ async def get_me(current_user: Users = Depends(get_current_active_user)):
                   response_model=User_Pydantic,
                   responses={404: {"model": HTTPNotFoundError}}
                   )
-async def update_user(user_data: UserUpdate, current_user: Users = Depends(get_current_active_user)):
+async def update_user(user_data: UserUpdate, current_user: Principal = Depends(get_current_active_user)):
     """
     Изменить информацию текущего пользователя
     """
     await Users.filter(id=current_user.id).update(**user_data.dict(exclude_unset=True))
+    principal_cache.invalidate(user_id=current_user.id, username=current_user.username)
     return await User_Pydantic.from_queryset_single(Users.get(id=current_user.id))
 
 
@@ -0,0 +1,414 @@
+import asyncio
+import bisect
+import glob
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, AsyncIterator
+
+from tortoise import connections
+
+from config import archive_config
+from .currency import CurrencyType
+from .models import HistoryConvert, HistoryConvert_Pydantic
+from .pagination import PageParams, day_start
+from .shards import data_connection_names
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"HCSEG\x00\x01\x00"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MIN_TS, MAX_TS = -2**63, 2**63 - 1
+
+# строка сегмента: (id, user_id, currency_type_from, currency_type_to, value_from, value_to, created_at в мкс)
+COLUMNS = ("id", "user_id_id", "currency_type_from", "currency_type_to", "value_from", "value_to", "created_at")
+ID, USER, FROM, TO, VALUE_FROM, VALUE_TO, TS = range(7)
+# блок в заголовке: первый и последний ключ (user_id, created_at), мин./макс. время, смещение, длина, строк
+FIRST_USER, FIRST_TS, LAST_USER, LAST_TS, BLOCK_MIN_TS, BLOCK_MAX_TS, OFFSET, LENGTH, ROWS = range(9)
+
+
+def to_ts(moment: datetime) -> int:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def from_ts(ts: int) -> datetime:
+    return EPOCH + timedelta(microseconds=ts)
+
+
+def encode_row(row: tuple) -> list:
+    return [
+        row[ID], row[USER], row[FROM].value, row[TO].value,
+        format(row[VALUE_FROM], "f"), format(row[VALUE_TO], "f"), to_ts(row[TS]),
+    ]
+
+
+def write_segment(path: str, rows: list[list], cutoff: int, block_rows: int, level: int) -> None:
+    """
+    Неизменяемый файл сегмента: MAGIC, длина заголовка, заголовок JSON с разреженным индексом
+    по блокам, затем блоки - сжатые zlib JSON-массивы строк в порядке (user_id, created_at, id).
+    Пишется во временный файл и переименовывается: читатели видят только целый сегмент
+    """
+    rows = sorted(rows, key=lambda row: (row[USER], row[TS], row[ID]))
+    blocks, payload = [], bytearray()
+    for start in range(0, len(rows), block_rows):
+        chunk = rows[start:start + block_rows]
+        data = zlib.compress(json.dumps(chunk, separators=(",", ":")).encode(), level)
+        timestamps = [row[TS] for row in chunk]
+        blocks.append([
+            chunk[0][USER], chunk[0][TS], chunk[-1][USER], chunk[-1][TS],
+            min(timestamps), max(timestamps), len(payload), len(data), len(chunk),
+        ])
+        payload += data
+    ids = [row[ID] for row in rows]
+    header = json.dumps({
+        "first_id": min(ids),
+        "last_id": max(ids),
+        "cutoff": cutoff,
+        "rows": len(rows),
+        "min_ts": min(block[BLOCK_MIN_TS] for block in blocks),
+        "max_ts": max(block[BLOCK_MAX_TS] for block in blocks),
+        "blocks": blocks,
+    }, separators=(",", ":")).encode()
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<I", len(header)))
+        file.write(header)
+        file.write(payload)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    directory = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class Segment:
+    """
+    Сегмент, отображённый в память: заголовок читается один раз, блоки распаковываются по запросу
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path}: не файл сегмента")
+        (size,) = struct.unpack_from("<I", self._map, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(self._map[start:start + size])
+        self.data_offset = start + size
+        self.first_id = header["first_id"]
+        self.last_id = header["last_id"]
+        self.cutoff = header["cutoff"]
+        self.rows = header["rows"]
+        self.min_ts = header["min_ts"]
+        self.max_ts = header["max_ts"]
+        self.blocks = header["blocks"]
+        # последние ключи блоков не убывают: первый нужный блок ищется делением пополам
+        self._last_keys = [(block[LAST_USER], block[LAST_TS]) for block in self.blocks]
+
+    def read_block(self, block: list) -> list[list]:
+        offset = self.data_offset + block[OFFSET]
+        return json.loads(zlib.decompress(self._map[offset:offset + block[LENGTH]]))
+
+    def find_blocks(self, user_id: int | None = None, ts_min: int = MIN_TS, ts_max: int = MAX_TS) -> list[list]:
+        """
+        Блоки, диапазон которых в заголовке пересекается с запросом (без распаковки)
+        """
+        if self.max_ts < ts_min or self.min_ts > ts_max:
+            return []
+        if user_id is None:
+            return [block for block in self.blocks if block[BLOCK_MIN_TS] <= ts_max and block[BLOCK_MAX_TS] >= ts_min]
+        blocks = []
+        for block in self.blocks[bisect.bisect_left(self._last_keys, (user_id, ts_min)):]:
+            if (block[FIRST_USER], block[FIRST_TS]) > (user_id, ts_max):
+                break
+            blocks.append(block)
+        return blocks
+
+    def block_rows(
+            self, block: list, user_id: int | None = None, ts_min: int = MIN_TS, ts_max: int = MAX_TS
+    ) -> list[list]:
+        return [
+            row for row in self.read_block(block)
+            if (user_id is None or row[USER] == user_id) and ts_min <= row[TS] <= ts_max
+        ]
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class Archive:
+    """
+    Сегменты одной базы (основной или шарда); новые файлы подхватываются по изменению каталога
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.segments: list[Segment] = []
+        self._mtime: int | None = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> list[Segment]:
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            if mtime != self._mtime:
+                known = {segment.path for segment in self.segments}
+                added = [
+                    Segment(path) for path in sorted(glob.glob(os.path.join(self.directory, "*.seg")))
+                    if path not in known
+                ]
+                self.segments = sorted(self.segments + added, key=lambda segment: segment.first_id)
+                self._mtime = mtime
+            return self.segments
+
+    def close(self) -> None:
+        with self._lock:
+            for segment in self.segments:
+                segment.close()
+            self.segments = []
+            self._mtime = None
+
+
+archives: dict[str, Archive] = {}
+
+
+def archive(connection_name: str) -> Archive:
+    if connection_name not in archives:
+        archives[connection_name] = Archive(os.path.join(archive_config["directory"], connection_name))
+    return archives[connection_name]
+
+
+def page_bounds(page: PageParams) -> tuple[int, int]:
+    """
+    Диапазон created_at страницы в мкс: период и курсор
+    """
+    ts_min = to_ts(day_start(page.date_from)) if page.date_from else MIN_TS
+    ts_max = to_ts(day_start(page.date_to + timedelta(days=1))) - 1 if page.date_to else MAX_TS
+    if page.cursor:
+        ts_max = min(ts_max, to_ts(page.cursor[0]))
+    return ts_min, ts_max
+
+
+def cold_rows(
+        connection_name: str,
+        page: PageParams,
+        user_id: int | None,
+        currency_from: CurrencyType | None,
+        currency_to: CurrencyType | None,
+) -> list[list]:
+    """
+    Страница строк из сегментов (limit + 1, от новых к старым). Блоки всех сегментов перебираются
+    по убыванию самого нового времени в них (из заголовка, с учётом курсора): как только страница
+    набрана и следующий блок целиком старше её последней строки, остальные блоки не распаковываются
+    """
+    ts_min, ts_max = page_bounds(page)
+    cursor = (to_ts(page.cursor[0]), page.cursor[1]) if page.cursor else None
+    candidates = [
+        (min(block[BLOCK_MAX_TS], ts_max), segment, block)
+        for segment in archive(connection_name).refresh()
+        for block in segment.find_blocks(user_id, ts_min, ts_max)
+    ]
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    result: list[list] = []
+    for newest, segment, block in candidates:
+        if len(result) > page.limit and newest < result[page.limit][TS]:
+            break
+        for row in segment.block_rows(block, user_id, ts_min, ts_max):
+            if currency_from and row[FROM] != currency_from.value:
+                continue
+            if currency_to and row[TO] != currency_to.value:
+                continue
+            if cursor and (row[TS], row[ID]) >= cursor:
+                continue
+            result.append(row)
+        result.sort(key=lambda row: (row[TS], row[ID]), reverse=True)
+        del result[page.limit + 1:]
+    return result
+
+
+def to_history(row: list) -> HistoryConvert_Pydantic:
+    return HistoryConvert_Pydantic(
+        id=row[ID],
+        currency_type_from=row[FROM],
+        currency_type_to=row[TO],
+        value_from=Decimal(row[VALUE_FROM]),
+        value_to=Decimal(row[VALUE_TO]),
+        created_at=from_ts(row[TS]),
+    )
+
+
+async def cold_history(
+        connection_name: str,
+        page: PageParams,
+        user_id: int | None = None,
+        currency_from: CurrencyType | None = None,
+        currency_to: CurrencyType | None = None,
+) -> list[HistoryConvert_Pydantic]:
+    if not archive(connection_name).refresh():
+        return []
+    rows = await asyncio.to_thread(cold_rows, connection_name, page, user_id, currency_from, currency_to)
+    return [to_history(row) for row in rows]
+
+
+def merge_history(hot: list[Any], cold: list[Any], limit: int) -> list[Any]:
+    """
+    Слить страницу из базы со страницей из сегментов. Строка, уже записанная в сегмент,
+    но ещё не удалённая из базы (перенос прерван), попадает в ответ один раз
+    """
+    rows, seen = [], set()
+    for row in heapq.merge(hot, cold, key=lambda row: (row.created_at, row.id), reverse=True):
+        if row.id in seen:
+            continue
+        seen.add(row.id)
+        rows.append(row)
+        if len(rows) > limit:
+            break
+    return rows
+
+
+async def cold_export_rows(
+        connection_name: str, user_id: int | None = None, date_from: date | None = None, date_to: date | None = None
+) -> AsyncIterator[dict]:
+    """
+    Строки сегментов для выгрузки конвертаций (они старше строк в базе): сегменты по возрастанию id,
+    внутри - в порядке хранения (user_id, created_at, id). В памяти не больше одного распакованного блока
+    """
+    ts_min = to_ts(day_start(date_from)) if date_from else MIN_TS
+    ts_max = to_ts(day_start(date_to + timedelta(days=1))) - 1 if date_to else MAX_TS
+    for segment in archive(connection_name).refresh():
+        for block in segment.find_blocks(user_id, ts_min, ts_max):
+            rows = await asyncio.to_thread(segment.block_rows, block, user_id, ts_min, ts_max)
+            for row in rows:
+                yield {
+                    "id": row[ID],
+                    "user_id_id": row[USER],
+                    "currency_type_from": row[FROM],
+                    "currency_type_to": row[TO],
+                    "value_from": Decimal(row[VALUE_FROM]),
+                    "value_to": Decimal(row[VALUE_TO]),
+                    "created_at": from_ts(row[TS]),
+                }
+
+
+async def archive_history(
+        connection_name: str, older_than: timedelta, segment_rows: int, block_rows: int, level: int
+) -> int:
+    """
+    Перенести конвертации старше older_than из базы в сегменты порциями по segment_rows.
+    Сегмент публикуется до удаления строк; прерванный перенос удаление довершает при следующем запуске.
+    Возвращает число перенесённых строк
+    """
+    store = archive(connection_name)
+    connection = connections.get(connection_name)
+    os.makedirs(store.directory, exist_ok=True)
+    segments = store.refresh()
+    if segments:
+        last = segments[-1]
+        await HistoryConvert.filter(id__lte=last.last_id, created_at__lt=from_ts(last.cutoff)).using_db(
+            connection
+        ).delete()
+    cutoff = datetime.now(timezone.utc) - older_than
+    moved = 0
+    while True:
+        rows = await HistoryConvert.filter(created_at__lt=cutoff).order_by("id").limit(segment_rows).using_db(
+            connection
+        ).values_list(*COLUMNS)
+        if not rows:
+            return moved
+        first_id, last_id = rows[0][ID], rows[-1][ID]
+        path = os.path.join(store.directory, f"{first_id:012d}-{last_id:012d}.seg")
+        encoded = [encode_row(row) for row in rows]
+        await asyncio.to_thread(write_segment, path, encoded, to_ts(cutoff), block_rows, level)
+        await HistoryConvert.filter(id__gte=first_id, id__lte=last_id, created_at__lt=cutoff).using_db(
+            connection
+        ).delete()
+        moved += len(rows)
+        if len(rows) < segment_rows:
+            return moved
+
+
+class ArchiveJobs:
+    """
+    Фоновый перенос старых конвертаций в сегменты по всем базам с данными
+    """
+
+    def __init__(self, interval: float, after_days: int, segment_rows: int, block_rows: int, level: int):
+        self.interval = interval
+        self.after_days = after_days
+        self.segment_rows = segment_rows
+        self.block_rows = block_rows
+        self.level = level
+        self.moved = 0
+        self.archived_at: datetime | None = None
+        self._task: asyncio.Task | None = None
+
+    async def run(self) -> int:
+        moved = 0
+        for name in data_connection_names():
+            moved += await archive_history(
+                name, timedelta(days=self.after_days), self.segment_rows, self.block_rows, self.level
+            )
+        self.moved += moved
+        self.archived_at = datetime.now(timezone.utc)
+        return moved
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                logger.warning("Перенос конвертаций в архив не удался: %r", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict[str, Any]:
+        segments = {}
+        for name in data_connection_names():
+            stored = archive(name).refresh()
+            segments[name] = {"segments": len(stored), "rows": sum(segment.rows for segment in stored)}
+        return {"moved": self.moved, "archived_at": self.archived_at, "segments": segments}
+
+
+archive_jobs = ArchiveJobs(
+    interval=archive_config["interval"],
+    after_days=archive_config["after_days"],
+    segment_rows=archive_config["segment_rows"],
+    block_rows=archive_config["block_rows"],
+    level=archive_config["compress_level"],
+)
+
+
+def start_archive_jobs() -> None:
+    if archive_config["jobs_enabled"]:
+        archive_jobs.start()
+
+
+async def stop_archive_jobs() -> None:
+    await archive_jobs.stop()
+    for store in archives.values():
+        store.close()
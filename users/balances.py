@@ -0,0 +1,139 @@
+from decimal import Decimal
+
+from tortoise import timezone
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import F
+from tortoise.queryset import QuerySet
+
+from .currency import PostingKind, SystemAccount
+from .ledger import record
+from .models import Checks
+
+
+# точность сумм на счетах и в журнале: DecimalField(decimal_places=2)
+CENT = Decimal("0.01")
+
+
+def to_cents(amount: Decimal) -> Decimal:
+    """
+    Сумма, округлённая как её сохранит поле модели: списание, зачисление и проводка получают одно число
+    """
+    return Decimal(amount).quantize(CENT)
+
+
+class InsufficientFunds(Exception):
+    """
+    На счёте недостаточно средств (или он закрыт)
+    """
+
+
+def _lock_query(connection: BaseDBAsyncClient, *check_ids: int) -> QuerySet[Checks]:
+    # only("id") - выборка объектов: у values_list queryset-а FOR UPDATE не попадает в SQL
+    return Checks.filter(id__in=check_ids).order_by("id").select_for_update().only("id").using_db(connection)
+
+
+async def lock_checks(connection: BaseDBAsyncClient, *check_ids: int) -> None:
+    """
+    Блокировка счетов в порядке id (SELECT ... FOR UPDATE), чтобы встречные переводы
+    не взаимоблокировались. SQLite блокирует всю базу сам, там запрос не нужен
+    """
+    if connection.capabilities.support_for_update:
+        await _lock_query(connection, *check_ids)
+
+
+async def debit(connection: BaseDBAsyncClient, check_id: int, amount: Decimal) -> None:
+    """
+    Списание одним запросом: value = value - amount WHERE value >= amount
+    """
+    # + 0 - сравнение числом: в SQLite десятичные поля хранятся строкой
+    updated = await Checks.filter(id=check_id, is_open=True).annotate(
+        balance=F("value") + 0
+    ).filter(balance__gte=amount).using_db(connection).update(
+        value=F("value") - amount, updated_at=timezone.now()
+    )
+    if not updated:
+        raise InsufficientFunds(check_id)
+
+
+async def credit(connection: BaseDBAsyncClient, check_id: int, amount: Decimal) -> None:
+    """
+    Зачисление одним запросом: value = value + amount
+    """
+    updated = await Checks.filter(id=check_id, is_open=True).using_db(connection).update(
+        value=F("value") + amount, updated_at=timezone.now()
+    )
+    if not updated:
+        raise InsufficientFunds(check_id)
+
+
+async def move(
+        connection: BaseDBAsyncClient, check_from: int, amount_from: Decimal, check_to: int, amount_to: Decimal
+) -> None:
+    """
+    Обе части перевода/конвертации в одной транзакции connection
+    """
+    await lock_checks(connection, check_from, check_to)
+    await debit(connection, check_from, amount_from)
+    await credit(connection, check_to, amount_to)
+
+
+async def book_refill(connection: BaseDBAsyncClient, check: Checks, amount: Decimal) -> None:
+    """
+    Пополнение счёта с проводкой против кассы
+    """
+    amount = to_cents(amount)
+    await credit(connection, check.id, amount)
+    await record(
+        connection,
+        PostingKind.refill,
+        (check, check.currency_type, amount),
+        (SystemAccount.cash, check.currency_type, -amount),
+    )
+
+
+async def book_unfill(connection: BaseDBAsyncClient, check: Checks, amount: Decimal) -> None:
+    """
+    Вывод со счёта с проводкой против кассы
+    """
+    amount = to_cents(amount)
+    await debit(connection, check.id, amount)
+    await record(
+        connection,
+        PostingKind.unfill,
+        (check, check.currency_type, -amount),
+        (SystemAccount.cash, check.currency_type, amount),
+    )
+
+
+async def book_transfer(
+        connection: BaseDBAsyncClient, check_from: Checks, check_to: Checks, amount: Decimal
+) -> None:
+    """
+    Перевод между счетами с проводками обеих сторон
+    """
+    amount = to_cents(amount)
+    await move(connection, check_from.id, amount, check_to.id, amount)
+    await record(
+        connection,
+        PostingKind.transfer,
+        (check_from, check_from.currency_type, -amount),
+        (check_to, check_to.currency_type, amount),
+    )
+
+
+async def book_convert(
+        connection: BaseDBAsyncClient, check_from: Checks, amount_from: Decimal, check_to: Checks, amount_to: Decimal
+) -> None:
+    """
+    Конвертация: проводки по обеим валютам через счёт обмена
+    """
+    amount_from, amount_to = to_cents(amount_from), to_cents(amount_to)
+    await move(connection, check_from.id, amount_from, check_to.id, amount_to)
+    await record(
+        connection,
+        PostingKind.convert,
+        (check_from, check_from.currency_type, -amount_from),
+        (SystemAccount.exchange, check_from.currency_type, amount_from),
+        (SystemAccount.exchange, check_to.currency_type, -amount_to),
+        (check_to, check_to.currency_type, amount_to),
+    )
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotCache:
+    """
+    Снимок данных внешнего API с временем жизни.
+
+    Свежий снимок отдаётся сразу. Устаревший, но не старше ttl + grace,
+    тоже отдаётся сразу, а обновление запускается в фоне.
+    Запрос ждёт загрузки только если снимка нет или он совсем старый.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Awaitable[Any]], ttl: float, grace: float = 0):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.grace = grace
+        self._value: Any = None
+        self._fetched_at: float | None = None
+        self._lock = asyncio.Lock()
+        self._revalidation: asyncio.Task | None = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+
+    @property
+    def value(self) -> Any:
+        return self._value
+
+    def age(self) -> float | None:
+        if self._fetched_at is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    def is_fresh(self) -> bool:
+        age = self.age()
+        return age is not None and age < self.ttl
+
+    def is_usable(self) -> bool:
+        age = self.age()
+        return age is not None and age < self.ttl + self.grace
+
+    def is_refreshing(self) -> bool:
+        return self._lock.locked()
+
+    def invalidate(self) -> None:
+        self._value = None
+        self._fetched_at = None
+
+    def put(self, value: Any) -> None:
+        self._value = value
+        self._fetched_at = time.monotonic()
+
+    async def refresh(self, force: bool = True) -> Any:
+        """
+        Загрузить новый снимок (одна загрузка на все ожидающие запросы)
+        """
+        async with self._lock:
+            if not force and self.is_fresh():
+                return self._value
+            try:
+                value = await self.loader()
+            except Exception:
+                self.refresh_errors += 1
+                raise
+            self.put(value)
+            return value
+
+    def revalidate(self) -> None:
+        """
+        Обновить снимок в фоне, если обновление ещё не запущено
+        """
+        if self._revalidation is not None and not self._revalidation.done():
+            return
+        self._revalidation = asyncio.ensure_future(self._background_refresh())
+
+    async def _background_refresh(self) -> None:
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning("Фоновое обновление %s не удалось: %r", self.name, e)
+
+    async def get(self) -> Any:
+        if self.is_fresh():
+            self.hits += 1
+            return self._value
+        if self.is_usable():
+            self.stale_hits += 1
+            self.revalidate()
+            return self._value
+        self.misses += 1
+        return await self.refresh(force=False)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "age": self.age(),
+            "ttl": self.ttl,
+            "grace": self.grace,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refresh_errors": self.refresh_errors,
+        }
+
+
+class CacheRefresher:
+    """
+    Фоновое обновление снимков до истечения их времени жизни
+    """
+
+    def __init__(self, caches: list[SnapshotCache], interval: float, ahead: float):
+        self.caches = caches
+        self.interval = interval
+        self.ahead = ahead
+        self._task: asyncio.Task | None = None
+
+    async def warmup(self, timeout: float) -> None:
+        """
+        Заполнить снимки до начала приёма запросов
+        """
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*(cache.refresh() for cache in self.caches), return_exceptions=True),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Прогрев кэшей не уложился в %s с", timeout)
+            return
+        for cache, result in zip(self.caches, results):
+            if isinstance(result, Exception):
+                logger.warning("Прогрев %s не удался: %r", cache.name, result)
+
+    def _due(self, cache: SnapshotCache) -> bool:
+        if cache.is_refreshing():
+            return False
+        age = cache.age()
+        return age is None or age >= cache.ttl - self.ahead
+
+    async def _run(self) -> None:
+        while True:
+            due = [cache for cache in self.caches if self._due(cache)]
+            if due:
+                await asyncio.gather(*(cache.refresh() for cache in due), return_exceptions=True)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -1,33 +1,155 @@
-import httpx
+import asyncio
+from decimal import Decimal
 
 from config import currency_api_conf
+from .cache import CacheRefresher, SnapshotCache
+from .coalesce import SingleFlight
+from .providers import build_provider
+from .rates import RateTable
+
+# источник курсов (один API или цепочка с резервными)
+provider = build_provider(currency_api_conf.get('provider'))
+
+# одинаковые одновременные запросы к API выполняются один раз
+upstream_flight = SingleFlight()
+
+
+async def open_client() -> None:
+    """
+    Открытие клиентов источников курсов (при старте приложения)
+    """
+    await provider.open()
+
+
+async def close_client() -> None:
+    """
+    Закрытие клиентов источников курсов (при остановке приложения)
+    """
+    await provider.close()
+
+
+def _normalize_amount(value: str) -> str:
+    """
+    Единый вид суммы для ключа запроса ("100.00" и "1E+2" -> "100")
+    """
+    try:
+        amount = Decimal(value).normalize()
+    except ArithmeticError:
+        return str(value)
+    return format(amount, 'f')
+
+
+async def currency_latest(base: str) -> RateTable:
+    async def fetch():
+        return RateTable.from_latest(await provider.latest(base))
+
+    return await upstream_flight.do(('latest', base.upper()), fetch)
+
+
+async def _fetch_symbols() -> dict:
+    return await upstream_flight.do(('symbols',), provider.symbols)
+
+
+rate_cache = SnapshotCache(
+    name='rates',
+    loader=lambda: currency_latest(currency_api_conf.get('rates_base')),
+    ttl=currency_api_conf.get('rates_ttl'),
+    grace=currency_api_conf.get('rates_stale_grace'),
+)
+symbols_cache = SnapshotCache(
+    name='symbols',
+    loader=_fetch_symbols,
+    ttl=currency_api_conf.get('symbols_ttl'),
+    grace=currency_api_conf.get('symbols_stale_grace'),
+)
+refresher = CacheRefresher(
+    caches=[rate_cache, symbols_cache],
+    interval=currency_api_conf.get('refresh_interval'),
+    ahead=currency_api_conf.get('refresh_ahead'),
+)
+
+
+async def start_refresher() -> None:
+    """
+    Прогрев кэшей и запуск фонового обновления (при старте приложения)
+    """
+    await refresher.warmup(timeout=currency_api_conf.get('warmup_timeout'))
+    refresher.start()
+
+
+async def stop_refresher() -> None:
+    await refresher.stop()
+
+
+async def current_rates() -> RateTable | None:
+    """
+    Текущая таблица курсов; если API недоступен - последняя известная, None - если её нет
+    """
+    try:
+        return await rate_cache.get()
+    except Exception:
+        return rate_cache.value
 
 
 async def currency_converter(currency_from: str, currency_to: str, value: str):
-    params = {"from": currency_from, "to": currency_to, "amount": value}
-    url = f"{currency_api_conf.get('url')}/convert"
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=currency_api_conf.get('headers'), params=params)
-        return response.json()
+    table = await current_rates()
+    if table is not None and table.has(currency_from) and table.has(currency_to):
+        return table.as_convert_response(currency_from, currency_to, Decimal(value))
+
+    # таблицы нет - спрашиваем курс напрямую
+    async def fetch():
+        return await provider.convert(currency_from, currency_to, value)
+
+    key = ('convert', currency_from.upper(), currency_to.upper(), _normalize_amount(value))
+    return await upstream_flight.do(key, fetch)
+
+
+async def currency_prices(items: list[tuple[str, str, Decimal]]) -> list[Decimal]:
+    """
+    Цены для набора пар по одному снимку таблицы курсов
+    """
+    table = await current_rates()
+    if table is not None and all(table.has(currency) for item in items for currency in item[:2]):
+        return [
+            table.as_convert_response(currency_from, currency_to, value)["result"]
+            for currency_from, currency_to, value in items
+        ]
+
+    # таблицы нет - по запросу на каждую уникальную пару
+    converts = await asyncio.gather(*(
+        currency_converter(currency_from, currency_to, str(value)) for currency_from, currency_to, value in items
+    ))
+    return [Decimal(convert.get("result")) for convert in converts]
 
 
 async def currency_list():
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f'{currency_api_conf.get("url")}/symbols', headers=currency_api_conf.get('headers')
-        )
-        return response.json()
-
-
-async def currency_fluctuation(start_date: str, end_date: str, base: str, symbols: str):
-    params = {
-        "start_date": start_date,
-        "end_date": end_date,
-        "base": base,
-        "symbols": symbols
-    }
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f'{currency_api_conf.get("url")}/fluctuation', headers=currency_api_conf.get('headers'), params=params
-        )
-        return response.json()
+    return await symbols_cache.get()
+
+
+async def currency_timeseries(start_date: str, end_date: str, base: str, symbols: str) -> dict:
+    async def fetch():
+        return await provider.timeseries(start_date, end_date, base, symbols)
+
+    key = ('timeseries', start_date, end_date, base.upper(), ','.join(sorted(symbols.upper().split(','))))
+    return await upstream_flight.do(key, fetch)
+
+
+def coalescing_stats() -> dict[str, int]:
+    """
+    Счётчики объединённых запросов к API
+    """
+    return upstream_flight.stats()
+
+
+def cache_stats() -> dict[str, dict]:
+    """
+    Состояние кэшей курсов и справочника валют
+    """
+    return {cache.name: cache.stats() for cache in (rate_cache, symbols_cache)}
+
+
+def resilience_stats() -> dict[str, dict]:
+    """
+    Состояние источников курсов: предохранители, задержки, переключения
+    """
+    return {"provider": {"name": provider.name, **provider.stats()}}
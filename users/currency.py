@@ -1,5 +1,6 @@
 from enum import Enum
 from datetime import datetime
+from typing import ClassVar
 
 from pydantic import BaseModel, Field
 from pydantic.types import Decimal
@@ -178,6 +179,42 @@ class CurrencyType(str, Enum):
     ZWL = "ZWL"
 
 
+class PostingKind(str, Enum):
+    opening = "opening"
+    refill = "refill"
+    unfill = "unfill"
+    convert = "convert"
+    transfer = "transfer"
+
+
+class SystemAccount(str, Enum):
+    # пополнения и выводы
+    cash = "cash"
+    # обмен валют
+    exchange = "exchange"
+    # остатки, бывшие до ведения журнала
+    opening = "opening"
+    # переводы между шардами: списано у отправителя, ещё не зачислено получателю
+    transit = "transit"
+
+
+class TransferState(str, Enum):
+    # записан в журнал, идёт подготовка шардов
+    started = "started"
+    # решение принято, шаги выполняются (и повторяются при восстановлении)
+    committing = "committing"
+    aborting = "aborting"
+    # завершён
+    committed = "committed"
+    aborted = "aborted"
+
+
+class TransferStep(str, Enum):
+    prepare = "prepare"
+    commit = "commit"
+    abort = "abort"
+
+
 class CurrencyList(BaseModel):
     success: bool = True
     currencies: dict = Field('{"RUB": "Russian Ruble"}')
@@ -213,3 +250,32 @@ class CurrencyPrice(BaseModel):
     type_to: CurrencyType
     value: Decimal
     price: Decimal
+    quote_id: str | None = None
+    expires_at: datetime | None = None
+
+
+class PriceQuery(BaseModel):
+    type_from: CurrencyType
+    type_to: CurrencyType
+    value: Decimal
+
+
+class TransferDirection(str, Enum):
+    incoming = "in"
+    outgoing = "out"
+
+
+class TransferItem(BaseModel):
+    id: int
+    user_from: int
+    user_to: int
+    currency_type: CurrencyType
+    value: Decimal
+    created_at: datetime
+
+    # порядок колонок для values_list
+    FIELDS: ClassVar[tuple[str, ...]] = ("id", "user_from_id", "user_to_id", "currency_type", "value", "created_at")
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "TransferItem":
+        return cls.construct(**dict(zip(cls.__fields__, row)))
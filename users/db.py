@@ -0,0 +1,144 @@
+import asyncio
+from typing import Any, Awaitable, Callable, TypeVar
+
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from config import database_config
+
+T = TypeVar("T")
+WriteUnit = Callable[[BaseDBAsyncClient], Awaitable[T]]
+
+
+def read_connection() -> BaseDBAsyncClient:
+    """
+    Соединение для ручек только на чтение: реплика, если настроена, иначе основная база.
+    Реплика может отставать, поэтому после записи свои данные читаются с основной
+    """
+    if database_config["engine"] == "postgres" and database_config["replica_host"]:
+        return connections.get("replica")
+    return connections.get("default")
+
+
+class GroupCommitter:
+    """
+    Групповая фиксация для SQLite: короткие транзакции разных запросов выполняются в одной
+    транзакции базы, каждая в своей точке сохранения (ошибка откатывает только её).
+    Пока идёт фиксация пакета, следующие запросы копятся в очереди и уходят следующим пакетом
+    """
+
+    def __init__(self, max_batch: int, max_delay: float, connection_name: str = "default"):
+        self.connection_name = connection_name
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.units = 0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, unit: WriteUnit) -> Any:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((unit, future))
+        return await future
+
+    async def _collect(self) -> list[tuple[WriteUnit, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        if self.max_delay:
+            await asyncio.sleep(self.max_delay)
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _execute(self, batch: list[tuple[WriteUnit, asyncio.Future]]) -> list[tuple[bool, Any]]:
+        results = []
+        async with in_transaction(self.connection_name) as connection:
+            for number, (unit, future) in enumerate(batch):
+                if future.cancelled():
+                    results.append((False, None))
+                    continue
+                savepoint = f"unit_{number}"
+                await connection.execute_query(f"SAVEPOINT {savepoint}")
+                try:
+                    result = await unit(connection)
+                except Exception as e:
+                    await connection.execute_query(f"ROLLBACK TO {savepoint}")
+                    results.append((False, e))
+                else:
+                    results.append((True, result))
+                await connection.execute_query(f"RELEASE {savepoint}")
+        return results
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            try:
+                results = await self._execute(batch)
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+            self.batches += 1
+            self.units += len(batch)
+            # ответы - только после фиксации всего пакета
+            for (_, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "units": self.units,
+            "queued": self._queue.qsize() if self._queue else 0,
+        }
+
+
+# по одному на базу: на каждом шарде - своя очередь
+group_committers: dict[str, GroupCommitter] = {}
+
+
+def group_committer(connection_name: str) -> GroupCommitter:
+    if connection_name not in group_committers:
+        group_committers[connection_name] = GroupCommitter(
+            max_batch=database_config["group_commit_max_batch"],
+            max_delay=database_config["group_commit_max_delay"],
+            connection_name=connection_name,
+        )
+    return group_committers[connection_name]
+
+
+def group_commit_enabled(connection_name: str = "default") -> bool:
+    return database_config["group_commit"] and connections.get(connection_name).capabilities.dialect == "sqlite"
+
+
+async def run_write(unit: WriteUnit, connection_name: str = "default") -> Any:
+    """
+    Выполнить короткую транзакцию записи unit(connection) в базе connection_name: отдельной
+    транзакцией или в пакете групповой фиксации
+    """
+    if group_commit_enabled(connection_name):
+        return await group_committer(connection_name).submit(unit)
+    async with in_transaction(connection_name) as connection:
+        return await unit(connection)
+
+
+async def stop_group_commit() -> None:
+    for committer in group_committers.values():
+        await committer.stop()
@@ -0,0 +1,149 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from enum import Enum
+from typing import Any, AsyncIterator, Iterable
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import Q
+from tortoise.models import Model
+from tortoise.queryset import QuerySet
+
+from .models import HistoryConvert, Transfers
+from .archive import cold_export_rows
+from .pagination import day_start
+from .shards import data_name, read_connections
+
+# выгрузка -> (модель, колонки)
+EXPORTS: dict[str, tuple[type[Model], tuple[str, ...]]] = {
+    "conversions": (
+        HistoryConvert,
+        ("id", "user_id_id", "currency_type_from", "currency_type_to", "value_from", "value_to", "created_at"),
+    ),
+    "transfers": (
+        Transfers,
+        ("id", "user_from_id", "user_to_id", "currency_type", "value", "created_at"),
+    ),
+}
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+class ExportKind(str, Enum):
+    conversions = "conversions"
+    transfers = "transfers"
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return format(value, "f")
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def export_queryset(
+        kind: str,
+        connection: BaseDBAsyncClient,
+        user_id: int | None = None,
+        date_from: date | None = None,
+        date_to: date | None = None,
+) -> QuerySet:
+    model, _ = EXPORTS[kind]
+    queryset = model.all().using_db(connection)
+    if user_id is not None:
+        if model is Transfers:
+            queryset = queryset.filter(Q(user_from_id=user_id) | Q(user_to_id=user_id))
+        else:
+            queryset = queryset.filter(user_id_id=user_id)
+    if date_from:
+        queryset = queryset.filter(created_at__gte=day_start(date_from))
+    if date_to:
+        queryset = queryset.filter(created_at__lt=day_start(date_to + timedelta(days=1)))
+    return queryset
+
+
+async def iter_rows(queryset: QuerySet, columns: Iterable[str], chunk_size: int) -> AsyncIterator[dict]:
+    """
+    Строки порциями по chunk_size с продолжением по id: в памяти не больше одной порции
+    """
+    last_id = 0
+    while True:
+        chunk = await queryset.filter(id__gt=last_id).order_by("id").limit(chunk_size).values(*columns)
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]["id"]
+
+
+async def shard_rows(kind: str, chunk_size: int, **filters: Any) -> AsyncIterator[dict]:
+    """
+    Строки со всех шардов по очереди (без шардов - из одной базы); конвертации - вместе с архивом
+    """
+    _, columns = EXPORTS[kind]
+    for connection in read_connections():
+        if kind == "conversions":
+            async for row in cold_export_rows(data_name(connection), **filters):
+                yield row
+        async for row in iter_rows(export_queryset(kind, connection, **filters), columns, chunk_size):
+            yield row
+
+
+async def encode_rows(rows: AsyncIterator[dict], columns: tuple[str, ...], export_format: ExportFormat):
+    """
+    Строки в NDJSON или CSV (с заголовком)
+    """
+    if export_format == ExportFormat.csv:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        async for row in rows:
+            writer.writerow([_plain(row[column]) for column in columns])
+            # сбрасываем буфер, чтобы он не рос вместе с выгрузкой
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode()
+    else:
+        lines = []
+        async for row in rows:
+            lines.append(json.dumps({column: _plain(row[column]) for column in columns}, ensure_ascii=False))
+            if len(lines) >= 1000:
+                yield ("\n".join(lines) + "\n").encode()
+                lines = []
+        if lines:
+            yield ("\n".join(lines) + "\n").encode()
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(
+        kind: str,
+        export_format: ExportFormat,
+        chunk_size: int,
+        compress: bool = False,
+        **filters: Any,
+) -> AsyncIterator[bytes]:
+    _, columns = EXPORTS[kind]
+    rows = shard_rows(kind, chunk_size, **filters)
+    stream = encode_rows(rows, columns, export_format)
+    return gzip_stream(stream) if compress else stream
@@ -1,13 +1,70 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
 from passlib.context import CryptContext
 
 from config import auth_config
 
+# один хэшер на процесс (и на каждый процесс пула)
+hasher: CryptContext = CryptContext(
+    schemes=auth_config["hasher_schemes"],
+    deprecated=auth_config["hasher_deprecated"],
+    bcrypt__rounds=auth_config["hasher_rounds"],
+)
+
+_executor: Executor | None = None
+
 
 def get_hasher() -> CryptContext:
     """
     Получение хэшера
     """
-    hasher: CryptContext = CryptContext(
-        schemes=auth_config["hasher_schemes"], deprecated=auth_config["hasher_deprecated"]
-    )
     return hasher
+
+
+def get_executor() -> Executor:
+    """
+    Пул для хэширования вне цикла событий (потоки: bcrypt отпускает GIL, или процессы)
+    """
+    global _executor
+    if _executor is None:
+        if auth_config["hasher_pool"] == "process":
+            _executor = ProcessPoolExecutor(max_workers=auth_config["hasher_pool_size"])
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=auth_config["hasher_pool_size"], thread_name_prefix="hasher"
+            )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _hash(password: str) -> str:
+    return hasher.hash(password)
+
+
+def _verify_and_update(password: str, password_hash: str) -> tuple[bool, str | None]:
+    return hasher.verify_and_update(password, password_hash)
+
+
+async def hash_password(password: str) -> str:
+    """
+    Хэширование пароля в пуле
+    """
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), _hash, password)
+
+
+async def verify_password(password: str, password_hash: str | None) -> tuple[bool, str | None]:
+    """
+    Проверка пароля в пуле. Возвращает (верен ли пароль, новый хэш если текущий устарел)
+    """
+    if not password_hash:
+        return False, None
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), _verify_and_update, password, password_hash
+    )
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from config import ledger_config
+from .currency import CurrencyType, PostingKind, SystemAccount
+from .models import BalanceSnapshot, Checks, JobCheckpoint, LedgerEntry
+from .shards import data_connection_names
+
+logger = logging.getLogger(__name__)
+
+# (счёт пользователя или системный счёт, валюта, сумма со знаком)
+Posting = tuple[Checks | SystemAccount, CurrencyType, Decimal]
+
+
+async def record(connection: BaseDBAsyncClient, kind: PostingKind, *postings: Posting) -> str:
+    """
+    Записать проводки одной операции одним запросом; возвращает id операции
+    """
+    operation = uuid.uuid4().hex
+    await LedgerEntry.bulk_create(
+        [
+            LedgerEntry(
+                operation=operation,
+                kind=kind,
+                account_id=target.id if isinstance(target, Checks) else None,
+                system_account=target if isinstance(target, SystemAccount) else None,
+                currency_type=currency,
+                amount=amount,
+            )
+            for target, currency, amount in postings
+        ],
+        using_db=connection,
+    )
+    return operation
+
+
+async def ledger_balance(
+        account_id: int, at: datetime | None = None, connection: BaseDBAsyncClient | None = None
+) -> Decimal:
+    """
+    Остаток счёта по журналу (на момент at): последний снимок + проводки после него
+    """
+    snapshots = BalanceSnapshot.filter(account_id=account_id)
+    entries = LedgerEntry.filter(account_id=account_id)
+    if at is not None:
+        snapshots = snapshots.filter(created_at__lte=at)
+        entries = entries.filter(created_at__lte=at)
+    snapshot = await snapshots.order_by("-entry_id").using_db(connection).first()
+    balance = Decimal(0)
+    if snapshot is not None:
+        balance = snapshot.balance
+        entries = entries.filter(id__gt=snapshot.entry_id)
+    amounts = await entries.using_db(connection).values_list("amount", flat=True)
+    return balance + sum(amounts, Decimal(0))
+
+
+async def _checkpoint(name: str, connection: BaseDBAsyncClient) -> JobCheckpoint:
+    checkpoint, _ = await JobCheckpoint.get_or_create(name=name, using_db=connection)
+    return checkpoint
+
+
+def _contiguous(entries: list[tuple], position: int, gap_horizon: datetime) -> list[tuple]:
+    """
+    Проводки подряд по id после position. На пропуске id останавливаемся: проводку с ним пишет
+    незавершённая транзакция, и после сдвига позиции она бы не попала в снимок. Пропуск,
+    за которым проводки старше gap_horizon, считается откаченной транзакцией
+    """
+    contiguous = []
+    expected = position + 1
+    for entry in entries:
+        entry_id, created_at = entry[0], entry[-1]
+        if entry_id != expected and created_at >= gap_horizon:
+            break
+        contiguous.append(entry)
+        expected = entry_id + 1
+    return contiguous
+
+
+async def take_snapshots(chunk_size: int, lag: float, gap_timeout: float, connection_name: str = "default") -> int:
+    """
+    Снимки остатков по новым проводкам базы connection_name (порциями, позиция хранится в JobCheckpoint).
+    Позиция сдвигается только по непрерывному диапазону id. Возвращает число снимков
+    """
+    now = datetime.now(timezone.utc)
+    horizon = now - timedelta(seconds=lag)
+    gap_horizon = now - timedelta(seconds=gap_timeout)
+    taken = 0
+    while True:
+        async with in_transaction(connection_name) as connection:
+            checkpoint = await _checkpoint("snapshots", connection)
+            fetched = await LedgerEntry.filter(
+                id__gt=checkpoint.position, created_at__lt=horizon
+            ).order_by("id").limit(chunk_size).using_db(connection).values_list(
+                "id", "account_id", "amount", "created_at"
+            )
+            entries = _contiguous(fetched, checkpoint.position, gap_horizon)
+            if not entries:
+                return taken
+            deltas: dict[int, Decimal] = defaultdict(Decimal)
+            last_ids: dict[int, int] = {}
+            for entry_id, account_id, amount, _ in entries:
+                if account_id is not None:
+                    deltas[account_id] += amount
+                    last_ids[account_id] = entry_id
+            snapshots = []
+            for account_id, delta in deltas.items():
+                previous = await BalanceSnapshot.filter(account_id=account_id).order_by("-entry_id").using_db(
+                    connection
+                ).first()
+                balance = (previous.balance if previous else Decimal(0)) + delta
+                snapshots.append(BalanceSnapshot(account_id=account_id, entry_id=last_ids[account_id], balance=balance))
+            await BalanceSnapshot.bulk_create(snapshots, using_db=connection)
+            checkpoint.position = entries[-1][0]
+            await checkpoint.save(using_db=connection)
+        taken += len(snapshots)
+        if len(fetched) < chunk_size or len(entries) < len(fetched):
+            return taken
+
+
+def _amount(value: Any) -> Decimal:
+    # в SQLite десятичные поля - строки, а SUM по ним - число с плавающей точкой
+    return Decimal(str(value or 0)).quantize(Decimal("0.01"))
+
+
+def _reconcile_query(position: int, chunk_size: int) -> str:
+    """
+    Порция счетов с остатком по журналу одним запросом (один снимок данных):
+    последний снимок счёта + сумма проводок после него
+    """
+    checks = Checks._meta.db_table
+    snapshots = BalanceSnapshot._meta.db_table
+    entries = LedgerEntry._meta.db_table
+    return (
+        f'SELECT c."id", c."value", s."balance", ('
+        f'SELECT SUM(e."amount") FROM "{entries}" e '
+        f'WHERE e."account_id" = c."id" AND e."id" > COALESCE(s."entry_id", 0)) '
+        f'FROM "{checks}" c '
+        f'LEFT JOIN "{snapshots}" s ON s."account_id" = c."id" AND s."entry_id" = ('
+        f'SELECT MAX(m."entry_id") FROM "{snapshots}" m WHERE m."account_id" = c."id") '
+        f'WHERE c."id" > {int(position)} ORDER BY c."id" LIMIT {int(chunk_size)}'
+    )
+
+
+async def reconcile(chunk_size: int, connection_name: str = "default") -> list[dict[str, Any]]:
+    """
+    Сверка Checks.value с журналом базы connection_name порциями счетов; позиция хранится в JobCheckpoint,
+    после последней порции сверка начинается сначала. Возвращает расхождения
+    """
+    mismatches = []
+    while True:
+        async with in_transaction(connection_name) as connection:
+            checkpoint = await _checkpoint("reconcile", connection)
+            _, rows = await connection.execute_query(_reconcile_query(checkpoint.position, chunk_size))
+            last_id = None
+            for account_id, value, snapshot, tail in rows:
+                value, balance = _amount(value), _amount(snapshot) + _amount(tail)
+                if balance != value:
+                    mismatches.append(
+                        {"database": connection_name, "check_id": account_id, "value": value, "ledger": balance}
+                    )
+                last_id = account_id
+            done = len(rows) < chunk_size
+            checkpoint.position = 0 if done else last_id
+            await checkpoint.save(using_db=connection)
+        if done:
+            return mismatches
+
+
+async def open_balances() -> int:
+    """
+    Начальные проводки для остатков, накопленных до появления журнала
+    """
+    async with in_transaction("default") as connection:
+        checks = await Checks.exclude(value=0).using_db(connection)
+        for check in checks:
+            await record(
+                connection,
+                PostingKind.opening,
+                (check, check.currency_type, check.value),
+                (SystemAccount.opening, check.currency_type, -check.value),
+            )
+    return len(checks)
+
+
+class LedgerJobs:
+    """
+    Фоновые снимки остатков и сверка журнала
+    """
+
+    def __init__(
+            self, snapshot_interval: float, reconcile_interval: float, chunk_size: int, lag: float, gap_timeout: float
+    ):
+        self.snapshot_interval = snapshot_interval
+        self.reconcile_interval = reconcile_interval
+        self.chunk_size = chunk_size
+        self.lag = lag
+        self.gap_timeout = gap_timeout
+        self.snapshots = 0
+        self.reconciled_at: datetime | None = None
+        self.mismatches: list[dict[str, Any]] = []
+        self._tasks: list[asyncio.Task] = []
+
+    async def _every(self, interval: float, job) -> None:
+        while True:
+            try:
+                await job()
+            except Exception as e:
+                logger.warning("Задание журнала %s не удалось: %r", job.__name__, e)
+            await asyncio.sleep(interval)
+
+    async def snapshot(self) -> None:
+        for name in data_connection_names():
+            self.snapshots += await take_snapshots(self.chunk_size, self.lag, self.gap_timeout, name)
+
+    async def reconcile(self) -> None:
+        mismatches = []
+        for name in data_connection_names():
+            mismatches += await reconcile(self.chunk_size, name)
+        self.mismatches = mismatches
+        self.reconciled_at = datetime.now(timezone.utc)
+        for mismatch in self.mismatches:
+            logger.warning("Остаток счёта не сходится с журналом: %s", mismatch)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._every(self.snapshot_interval, self.snapshot)),
+                asyncio.create_task(self._every(self.reconcile_interval, self.reconcile)),
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "snapshots": self.snapshots,
+            "reconciled_at": self.reconciled_at,
+            "mismatches": self.mismatches[:100],
+        }
+
+
+ledger_jobs = LedgerJobs(
+    snapshot_interval=ledger_config["snapshot_interval"],
+    reconcile_interval=ledger_config["reconcile_interval"],
+    chunk_size=ledger_config["chunk_size"],
+    lag=ledger_config["snapshot_lag"],
+    gap_timeout=ledger_config["snapshot_gap_timeout"],
+)
+
+
+def start_ledger_jobs() -> None:
+    if ledger_config["jobs_enabled"]:
+        ledger_jobs.start()
+
+
+async def stop_ledger_jobs() -> None:
+    await ledger_jobs.stop()
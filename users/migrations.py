@@ -0,0 +1,114 @@
+import logging
+import re
+
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+from tortoise.utils import generate_schema_for_client
+
+from .ledger import open_balances
+from .models import Checks, TransferIntent, TransferPhase
+from .shards import SHARDED_MODELS, shard_names
+
+logger = logging.getLogger(__name__)
+
+# таблицы users на шардах нет: ссылки на пользователей там - просто номера
+USERS_REFERENCE = re.compile(r' REFERENCES "users" \("id"\) ON DELETE \w+')
+
+
+async def table_columns(connection: BaseDBAsyncClient, table: str) -> set[str]:
+    """
+    Колонки таблицы (пусто, если таблицы ещё нет)
+    """
+    if connection.capabilities.dialect == "sqlite":
+        _, rows = await connection.execute_query(f'PRAGMA table_info("{table}")')
+        return {row["name"] for row in rows}
+    _, rows = await connection.execute_query(
+        f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table}'"
+    )
+    return {row["column_name"] for row in rows}
+
+
+async def migrate_checks_owner(connection: BaseDBAsyncClient) -> None:
+    """
+    Счета: связь многие-ко-многим через users_checks -> внешний ключ owner_id
+    с уникальным индексом (owner_id, currency_type). Таблица users_checks остаётся для отката
+    """
+    columns = await table_columns(connection, "checks")
+    if not columns or "owner_id" in columns:
+        return
+    async with in_transaction("default") as transaction:
+        await transaction.execute_query(
+            'ALTER TABLE "checks" ADD COLUMN "owner_id" INT REFERENCES "users" ("id") ON DELETE CASCADE'
+        )
+        await transaction.execute_query(
+            'UPDATE "checks" SET "owner_id" = ('
+            'SELECT MIN("users_id") FROM "users_checks" WHERE "users_checks"."checks_id" = "checks"."id")'
+        )
+        _, duplicates = await transaction.execute_query(
+            'SELECT "owner_id", "currency_type" FROM "checks" WHERE "owner_id" IS NOT NULL '
+            'GROUP BY "owner_id", "currency_type" HAVING COUNT(*) > 1'
+        )
+        if duplicates:
+            raise RuntimeError(
+                f"У пользователей несколько счетов в одной валюте, объедините их вручную: "
+                f"{[(row['owner_id'], row['currency_type']) for row in duplicates]}"
+            )
+        await transaction.execute_query(
+            'CREATE UNIQUE INDEX "uid_checks_owner_currency" ON "checks" ("owner_id", "currency_type")'
+        )
+        _, orphans = await transaction.execute_query(
+            'SELECT COUNT(*) AS "count" FROM "checks" WHERE "owner_id" IS NULL'
+        )
+    logger.warning("Счета перенесены на owner_id, без владельца: %s", orphans[0]["count"])
+
+
+async def add_column(connection: BaseDBAsyncClient, table: str, column: str, definition: str) -> None:
+    """
+    Новая колонка существующей таблицы (новые таблицы создаются уже с ней)
+    """
+    columns = await table_columns(connection, table)
+    if columns and column not in columns:
+        await connection.execute_query(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}')
+
+
+async def migrate_transfer_ids(connection: BaseDBAsyncClient, coordinator: bool) -> None:
+    """
+    Переводы между шардами: id записи Transfers в шаге фиксации и в журнале (основная база)
+    """
+    await add_column(connection, TransferPhase._meta.db_table, "transfer_id", "INT")
+    if coordinator:
+        await add_column(connection, TransferIntent._meta.db_table, "transfer_id", "INT")
+
+
+async def create_shard_tables(connection: BaseDBAsyncClient) -> None:
+    """
+    Таблицы данных пользователей на шарде (если их ещё нет)
+    """
+    generator = connection.schema_generator(connection)
+    for model in SHARDED_MODELS:
+        sql = generator._get_table_sql(model, safe=True)["table_creation_string"]
+        for statement in USERS_REFERENCE.sub("", sql).split(";"):
+            if statement.strip():
+                await connection.execute_query(statement)
+
+
+async def upgrade_schema() -> None:
+    """
+    Миграции существующей базы, затем создание недостающих таблиц и индексов
+    """
+    connection = Tortoise.get_connection("default")
+    await migrate_checks_owner(connection)
+    await migrate_transfer_ids(connection, coordinator=True)
+    new_ledger = not await table_columns(connection, "ledgerentry")
+    # только основная база: реплика доступна лишь на чтение
+    await generate_schema_for_client(connection, safe=True)
+    if new_ledger:
+        opened = await open_balances()
+        if opened:
+            logger.warning("Начальные проводки журнала для %s счетов", opened)
+    for name in shard_names():
+        await migrate_transfer_ids(Tortoise.get_connection(name), coordinator=False)
+        await create_shard_tables(Tortoise.get_connection(name))
+    if shard_names() and await Checks.all().exists():
+        logger.warning("Счета в основной базе при шардировании не используются: перенесите их на шарды")
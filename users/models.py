@@ -1,7 +1,7 @@
 from tortoise import fields, models
 from tortoise.contrib.pydantic import pydantic_model_creator
 
-from .currency import CurrencyType
+from .currency import CurrencyType, PostingKind, SystemAccount, TransferState, TransferStep
 
 
 class Users(models.Model):
@@ -20,6 +20,10 @@ class Users(models.Model):
     created_at = fields.DatetimeField(auto_now_add=True)
     updated_at = fields.DatetimeField(auto_now=True)
 
+    class Meta:
+        # списки подтверждённых/неподтверждённых по страницам (created_at, id)
+        indexes = (("is_approved", "is_superuser", "created_at", "id"),)
+
     def full_name(self) -> str:
         """
         Полное имя
@@ -38,13 +42,17 @@ class Checks(models.Model):
     Счета пользователей
     """
     id = fields.IntField(pk=True)
-    user_id = fields.ManyToManyField('models.Users', related_name='user_id', through='users_checks')
+    owner = fields.ForeignKeyField('models.Users', related_name='checks')
     value = fields.DecimalField(max_digits=100, decimal_places=2, default=0)
     currency_type = fields.CharEnumField(CurrencyType, default=CurrencyType.RUB)
     is_open = fields.BooleanField(default=True)
     created_at = fields.DatetimeField(auto_now_add=True)
     updated_at = fields.DatetimeField(auto_now=True)
 
+    class Meta:
+        # один счёт в валюте на пользователя; поиск счёта - одна проба по индексу
+        unique_together = (("owner", "currency_type"),)
+
 
 class Transfers(models.Model):
     """
@@ -57,6 +65,15 @@ class Transfers(models.Model):
     currency_type = fields.CharEnumField(CurrencyType, default=CurrencyType.RUB)
     created_at = fields.DatetimeField(auto_now_add=True)
 
+    class Meta:
+        # списки переводов по отправителю, получателю и валюте страницами (created_at, id)
+        indexes = (
+            ("user_from_id", "created_at", "id"),
+            ("user_to_id", "created_at", "id"),
+            ("currency_type", "created_at", "id"),
+            ("created_at", "id"),
+        )
+
     class PydanticMeta:
         exclude = ["id"]
 
@@ -73,6 +90,124 @@ class HistoryConvert(models.Model):
     value_from = fields.DecimalField(max_digits=100, decimal_places=2)
     created_at = fields.DatetimeField(auto_now_add=True)
 
+    class Meta:
+        # страницы по (created_at, id): история пользователя, вся история и отбор по валюте
+        indexes = (
+            ("user_id_id", "created_at", "id"),
+            ("created_at", "id"),
+            ("currency_type_from", "created_at", "id"),
+            ("currency_type_to", "created_at", "id"),
+        )
+
+
+class RefreshTokens(models.Model):
+    """
+    Токены обновления (хранится только хэш)
+    """
+    id = fields.IntField(pk=True)
+    user = fields.ForeignKeyField('models.Users', related_name='refresh_tokens')
+    token_hash = fields.CharField(max_length=64, unique=True)
+    family = fields.CharField(max_length=32, index=True)
+    expires_at = fields.DatetimeField()
+    revoked_at = fields.DatetimeField(null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+
+class DailyRate(models.Model):
+    """
+    Дневные курсы валют (история для колебаний)
+    """
+    id = fields.IntField(pk=True)
+    date = fields.DateField()
+    base = fields.CharField(max_length=3)
+    symbol = fields.CharField(max_length=3)
+    rate = fields.DecimalField(max_digits=30, decimal_places=12)
+
+    class Meta:
+        # индекс под выборку диапазона дат по базе и валютам
+        unique_together = (("base", "symbol", "date"),)
+
+
+class LedgerEntry(models.Model):
+    """
+    Проводка журнала (только добавление). Проводки одной операции в каждой валюте дают в сумме ноль:
+    вторая сторона - счёт пользователя или системный счёт (system_account)
+    """
+    id = fields.BigIntField(pk=True)
+    operation = fields.CharField(max_length=32)
+    kind = fields.CharEnumField(PostingKind)
+    account = fields.ForeignKeyField('models.Checks', related_name='postings', null=True)
+    system_account = fields.CharEnumField(SystemAccount, null=True)
+    currency_type = fields.CharEnumField(CurrencyType)
+    amount = fields.DecimalField(max_digits=100, decimal_places=2)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        # остаток счёта: снимок + проводки после него
+        indexes = (("account_id", "id"), ("operation",))
+
+
+class BalanceSnapshot(models.Model):
+    """
+    Остаток счёта по журналу на проводку entry_id включительно
+    """
+    id = fields.IntField(pk=True)
+    account = fields.ForeignKeyField('models.Checks', related_name='snapshots')
+    entry_id = fields.BigIntField()
+    balance = fields.DecimalField(max_digits=100, decimal_places=2)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (("account", "entry_id"),)
+        indexes = (("account_id", "created_at"),)
+
+
+class JobCheckpoint(models.Model):
+    """
+    Позиция фоновых заданий (снимки, сверка) для продолжения после перезапуска
+    """
+    name = fields.CharField(max_length=32, pk=True)
+    position = fields.BigIntField(default=0)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+
+class TransferIntent(models.Model):
+    """
+    Журнал перевода между шардами (двухфазная фиксация), хранится в основной базе.
+    Переводы, не дошедшие до committed/aborted, доводит восстановление
+    """
+    id = fields.BigIntField(pk=True)
+    user_from_id = fields.IntField()
+    user_to_id = fields.IntField()
+    check_from_id = fields.IntField()
+    check_to_id = fields.IntField()
+    currency_type = fields.CharEnumField(CurrencyType)
+    value = fields.DecimalField(max_digits=100, decimal_places=2)
+    state = fields.CharEnumField(TransferState, default=TransferState.started)
+    # запись Transfers на шарде отправителя (после фиксации)
+    transfer_id = fields.IntField(null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        indexes = (("state", "updated_at"),)
+
+
+class TransferPhase(models.Model):
+    """
+    Шаг перевода между шардами, выполненный на шарде (в одной транзакции с самим шагом):
+    повторно шаг не выполняется
+    """
+    id = fields.IntField(pk=True)
+    intent_id = fields.BigIntField()
+    phase = fields.CharEnumField(TransferStep)
+    # фиксация на шарде отправителя: созданная в том же шаге запись Transfers
+    transfer_id = fields.IntField(null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (("intent_id", "phase"),)
+
 
 User_Pydantic = pydantic_model_creator(Users, name="User")
 UserIn_Pydantic = pydantic_model_creator(Users, name="UserIn", exclude_readonly=True)
@@ -0,0 +1,68 @@
+import base64
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any
+
+from fastapi import HTTPException, Query, Response, status
+from tortoise.expressions import Q
+from tortoise.queryset import QuerySet
+
+from config import pagination_config
+
+CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, pk: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{pk}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Некорректный курсор")
+
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min, timezone.utc)
+
+
+class PageParams:
+    """
+    Параметры страницы: курсор (из заголовка X-Next-Cursor прошлой страницы), размер и период
+    """
+
+    def __init__(
+            self,
+            cursor: str | None = None,
+            limit: int = Query(pagination_config["default_limit"], ge=1, le=pagination_config["max_limit"]),
+            date_from: date | None = None,
+            date_to: date | None = None,
+    ):
+        self.cursor = decode_cursor(cursor) if cursor else None
+        self.limit = limit
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def apply(self, queryset: QuerySet) -> QuerySet:
+        """
+        Страница по ключу (created_at, id) от новых к старым: WHERE (created_at, id) < курсор
+        """
+        if self.date_from:
+            queryset = queryset.filter(created_at__gte=day_start(self.date_from))
+        if self.date_to:
+            queryset = queryset.filter(created_at__lt=day_start(self.date_to + timedelta(days=1)))
+        if self.cursor:
+            created_at, pk = self.cursor
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        # лишняя запись - признак того, что есть следующая страница
+        return queryset.order_by("-created_at", "-id").limit(self.limit + 1)
+
+    def page(self, rows: list[Any], response: Response) -> list[Any]:
+        """
+        Обрезать лишнюю запись и отдать курсор следующей страницы в заголовке
+        """
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            response.headers[CURSOR_HEADER] = encode_cursor(rows[-1].created_at, rows[-1].id)
+        return rows
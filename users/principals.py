@@ -0,0 +1,123 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from config import auth_config
+from .models import Users
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    Текущий пользователь для авторизации: только то, что нужно ручкам, без хэша пароля
+    """
+    id: int
+    username: str
+    is_superuser: bool
+    is_active: bool
+    is_approved: bool
+
+    @property
+    def role(self) -> str:
+        return "admin" if self.is_superuser else "user"
+
+    @classmethod
+    def from_user(cls, user: Users) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            is_superuser=user.is_superuser,
+            is_active=user.is_active,
+            is_approved=user.is_approved,
+        )
+
+
+class PrincipalCache:
+    """
+    Кэш пользователей для авторизации: время жизни + вытеснение давно не используемых.
+    Ключ - имя пользователя; индекс по id нужен для сброса из админских ручек.
+    Сброс действует только в своём процессе: другие воркеры видят изменения через ttl
+    """
+
+    def __init__(self, ttl: float, max_items: int):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._items: OrderedDict[str, tuple[float, Principal]] = OrderedDict()
+        self._usernames: dict[int, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, username: str) -> Principal | None:
+        item = self._items.get(username)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, user = item
+        if time.monotonic() >= expires_at:
+            self._drop(username)
+            self.misses += 1
+            return None
+        self._items.move_to_end(username)
+        self.hits += 1
+        return user
+
+    def put(self, user: Principal) -> None:
+        if user.username in self._items:
+            self._items.move_to_end(user.username)
+        self._items[user.username] = (time.monotonic() + self.ttl, user)
+        self._usernames[user.id] = user.username
+        while len(self._items) > self.max_items:
+            username, (_, evicted) = self._items.popitem(last=False)
+            self._usernames.pop(evicted.id, None)
+            self.evictions += 1
+
+    def _drop(self, username: str) -> None:
+        item = self._items.pop(username, None)
+        if item is not None:
+            self._usernames.pop(item[1].id, None)
+
+    def invalidate(self, user_id: int | None = None, username: str | None = None) -> None:
+        """
+        Сбросить пользователя из кэша (блокировка, подтверждение, изменение профиля)
+        """
+        if user_id is not None and user_id in self._usernames:
+            self._drop(self._usernames[user_id])
+        if username is not None:
+            self._drop(username)
+        self.invalidations += 1
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._usernames.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "size": len(self._items),
+            "max_items": self.max_items,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+principal_cache = PrincipalCache(
+    ttl=auth_config["principal_cache_ttl"],
+    max_items=auth_config["principal_cache_size"],
+)
+
+
+async def get_principal(username: str) -> Principal | None:
+    """
+    Пользователь из кэша, а при промахе - из базы
+    """
+    principal = principal_cache.get(username)
+    if principal is None:
+        user = await Users.get_or_none(username=username)
+        if user is not None:
+            principal = Principal.from_user(user)
+            principal_cache.put(principal)
+    return principal
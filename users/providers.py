@@ -0,0 +1,275 @@
+import abc
+import importlib.util
+import json
+import time
+from decimal import Decimal
+from typing import Any
+
+import httpx
+
+from config import currency_api_conf
+from .resilience import (
+    CircuitBreaker, LatencyTracker, UpstreamFailed, UpstreamRejected, UpstreamUnavailable, hedged, remaining,
+    reset_deadline, set_deadline, within_deadline,
+)
+
+
+def _decode(response: httpx.Response) -> dict:
+    """
+    Разбор ответа без потери точности курсов
+    """
+    return json.loads(response.content, parse_float=Decimal)
+
+
+class RateProvider(abc.ABC):
+    """
+    Источник курсов валют
+    """
+    name: str = "provider"
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def convert(self, currency_from: str, currency_to: str, amount: str) -> dict:
+        ...
+
+    @abc.abstractmethod
+    async def latest(self, base: str) -> dict:
+        ...
+
+    @abc.abstractmethod
+    async def symbols(self) -> dict:
+        ...
+
+    @abc.abstractmethod
+    async def timeseries(self, start_date: str, end_date: str, base: str, symbols: str) -> dict:
+        ...
+
+    def stats(self) -> dict[str, Any]:
+        return {}
+
+
+class HttpRateProvider(RateProvider):
+    """
+    Источник с API в формате exchangerates_data: пул соединений, предохранитель,
+    бюджет времени запроса и дублирование медленных запросов
+    """
+
+    def __init__(
+            self, name: str, url: str, headers: dict | None = None, transport: httpx.AsyncBaseTransport | None = None
+    ):
+        self.name = name
+        self.url = url
+        self.headers = headers or {}
+        self.transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self.breaker = CircuitBreaker(
+            name=name,
+            failure_threshold=currency_api_conf.get('breaker_failure_threshold'),
+            reset_timeout=currency_api_conf.get('breaker_reset_timeout'),
+        )
+        self.latency = LatencyTracker(size=currency_api_conf.get('latency_window'))
+        self.hedged = 0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        """
+        Создание клиента с пулом keep-alive соединений
+        """
+        limits = httpx.Limits(
+            max_connections=currency_api_conf.get('max_connections'),
+            max_keepalive_connections=currency_api_conf.get('max_keepalive_connections'),
+            keepalive_expiry=currency_api_conf.get('keepalive_expiry'),
+        )
+        timeout = httpx.Timeout(
+            connect=currency_api_conf.get('connect_timeout'),
+            read=currency_api_conf.get('read_timeout'),
+            write=currency_api_conf.get('write_timeout'),
+            pool=currency_api_conf.get('pool_timeout'),
+        )
+        # HTTP/2 доступен только если установлен пакет h2
+        http2 = currency_api_conf.get('http2') and importlib.util.find_spec('h2') is not None
+        return httpx.AsyncClient(
+            base_url=self.url,
+            headers=self.headers,
+            limits=limits,
+            timeout=timeout,
+            http2=http2 and self.transport is None,
+            transport=self.transport,
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Общий клиент на всё время жизни приложения
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    async def open(self) -> None:
+        self.client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def hedge_delay(self) -> float | None:
+        """
+        Задержка перед дублирующим запросом: p95 последних ответов
+        """
+        if not currency_api_conf.get('hedge_enabled'):
+            return None
+        if self.latency.stats()["samples"] < currency_api_conf.get('hedge_min_samples'):
+            return None
+        percentile = self.latency.percentile(currency_api_conf.get('hedge_percentile'))
+        return max(currency_api_conf.get('hedge_min_delay'), percentile)
+
+    async def _get(self, path: str, params: dict | None = None) -> dict:
+        """
+        GET через предохранитель, с бюджетом времени запроса и дублированием
+        """
+        async def attempt():
+            started = time.monotonic()
+            response = await self.client.get(path, params=params)
+            # ошибки сервера и превышение квоты считаются сбоем API
+            if response.status_code >= 500 or response.status_code == 429:
+                raise UpstreamFailed(response.status_code)
+            self.latency.observe(time.monotonic() - started)
+            return response
+
+        async def call():
+            response, was_hedged = await hedged(attempt, self.hedge_delay())
+            if was_hedged:
+                self.hedged += 1
+            return response
+
+        response = await self.breaker.call(lambda: within_deadline(call()))
+        # отказ в запросе - не сбой API, предохранитель его не учитывает
+        if response.is_error:
+            raise UpstreamRejected(response.status_code)
+        return _decode(response)
+
+    async def convert(self, currency_from: str, currency_to: str, amount: str) -> dict:
+        return await self._get('/convert', params={"from": currency_from, "to": currency_to, "amount": amount})
+
+    async def latest(self, base: str) -> dict:
+        return await self._get('/latest', params={"base": base})
+
+    async def symbols(self) -> dict:
+        return await self._get('/symbols')
+
+    async def timeseries(self, start_date: str, end_date: str, base: str, symbols: str) -> dict:
+        params = {
+            "start_date": start_date,
+            "end_date": end_date,
+            "base": base,
+            "symbols": symbols
+        }
+        return await self._get('/timeseries', params=params)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "breaker": self.breaker.stats(),
+            "latency": self.latency.stats(),
+            "hedge": {
+                "enabled": currency_api_conf.get('hedge_enabled'),
+                "delay": self.hedge_delay(),
+                "hedged": self.hedged,
+            },
+        }
+
+
+class FailoverProvider(RateProvider):
+    """
+    Цепочка источников: при сбое запрос уходит к следующему по порядку.
+    Источнику достаётся доля оставшегося бюджета времени, чтобы следующим тоже хватило
+    """
+    name = "failover"
+
+    def __init__(self, providers: list[RateProvider]):
+        self.providers = providers
+        self.failovers = 0
+
+    async def open(self) -> None:
+        for provider in self.providers:
+            await provider.open()
+
+    async def close(self) -> None:
+        for provider in self.providers:
+            await provider.close()
+
+    async def _first(self, method: str, *args) -> dict:
+        error: Exception | None = None
+        for number, provider in enumerate(self.providers):
+            budget = remaining()
+            left = len(self.providers) - number
+            token = set_deadline(budget / left) if budget is not None and budget > 0 else None
+            try:
+                return await getattr(provider, method)(*args)
+            except (UpstreamUnavailable, httpx.HTTPError) as e:
+                error = e
+                self.failovers += 1
+            finally:
+                if token is not None:
+                    reset_deadline(token)
+        raise error
+
+    async def convert(self, currency_from: str, currency_to: str, amount: str) -> dict:
+        return await self._first('convert', currency_from, currency_to, amount)
+
+    async def latest(self, base: str) -> dict:
+        return await self._first('latest', base)
+
+    async def symbols(self) -> dict:
+        return await self._first('symbols')
+
+    async def timeseries(self, start_date: str, end_date: str, base: str, symbols: str) -> dict:
+        return await self._first('timeseries', start_date, end_date, base, symbols)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "failovers": self.failovers,
+            "providers": {provider.name: provider.stats() for provider in self.providers},
+        }
+
+
+def apilayer_provider() -> HttpRateProvider:
+    return HttpRateProvider(
+        name="apilayer", url=currency_api_conf.get('url'), headers=currency_api_conf.get('headers')
+    )
+
+
+def local_provider() -> HttpRateProvider:
+    """
+    Локальный заменитель API: отдельный сервер по local_url или приложение в том же процессе
+    """
+    url = currency_api_conf.get('local_url')
+    if url:
+        return HttpRateProvider(name="local", url=url)
+    from .standin import app as standin_app
+    return HttpRateProvider(name="local", url="http://standin", transport=httpx.ASGITransport(app=standin_app))
+
+
+PROVIDERS = {
+    "apilayer": apilayer_provider,
+    "local": local_provider,
+}
+
+
+def build_provider(chain: str) -> RateProvider:
+    """
+    Источник по настройке: "apilayer", "local" или цепочка "apilayer,local"
+    """
+    names = [name.strip() for name in chain.split(',') if name.strip()]
+    unknown = [name for name in names if name not in PROVIDERS]
+    if not names or unknown:
+        raise ValueError(f"Неизвестный источник курсов: {chain}")
+    providers = [PROVIDERS[name]() for name in names]
+    if len(providers) == 1:
+        return providers[0]
+    return FailoverProvider(providers)
@@ -0,0 +1,107 @@
+import contextlib
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from config import currency_api_conf
+
+
+class QuoteUnavailable(Exception):
+    """
+    Котировки нет: истекла, чужая или уже исполнена
+    """
+
+
+@dataclass
+class Quote:
+    """
+    Зафиксированный курс конвертации
+    """
+    id: str
+    user_id: int
+    type_from: str
+    type_to: str
+    value: Decimal
+    price: Decimal
+    expires_at: datetime
+    deadline: float
+
+    def is_expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+
+class QuoteStore:
+    """
+    Хранилище котировок в памяти с истечением срока.
+
+    Срок жизни у всех котировок одинаковый, поэтому порядок добавления совпадает
+    с порядком истечения и просроченные удаляются с начала очереди.
+    """
+
+    def __init__(self, ttl: float, max_items: int):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._quotes: OrderedDict[str, Quote] = OrderedDict()
+        self.issued = 0
+        self.settled = 0
+
+    def _purge(self) -> None:
+        while self._quotes:
+            quote = next(iter(self._quotes.values()))
+            if not quote.is_expired() and len(self._quotes) < self.max_items:
+                break
+            self._quotes.popitem(last=False)
+
+    def issue(self, user_id: int, type_from: str, type_to: str, value: Decimal, price: Decimal) -> Quote:
+        self._purge()
+        quote = Quote(
+            id=secrets.token_urlsafe(16),
+            user_id=user_id,
+            type_from=type_from,
+            type_to=type_to,
+            value=value,
+            price=price,
+            expires_at=datetime.now(timezone.utc) + timedelta(seconds=self.ttl),
+            deadline=time.monotonic() + self.ttl,
+        )
+        self._quotes[quote.id] = quote
+        self.issued += 1
+        return quote
+
+    def peek(self, quote_id: str, user_id: int) -> Quote | None:
+        """
+        Котировка для проверки перед исполнением; None - нет, просрочена или чужая
+        """
+        quote = self._quotes.get(quote_id)
+        if quote is None or quote.user_id != user_id or quote.is_expired():
+            return None
+        return quote
+
+    @contextlib.contextmanager
+    def settle(self, quote: Quote):
+        """
+        Исполнение котировки: она снимается на время записи (повторный запрос её не получит)
+        и возвращается, если запись не удалась
+        """
+        if self._quotes.pop(quote.id, None) is None or quote.is_expired():
+            raise QuoteUnavailable(quote.id)
+        try:
+            yield quote
+        except BaseException:
+            # возвращается в начало очереди: она старше большинства выданных после неё
+            self._quotes[quote.id] = quote
+            self._quotes.move_to_end(quote.id, last=False)
+            raise
+        self.settled += 1
+
+    def stats(self) -> dict[str, int]:
+        return {"active": len(self._quotes), "issued": self.issued, "settled": self.settled}
+
+
+quote_store = QuoteStore(
+    ttl=currency_api_conf.get('quote_ttl'),
+    max_items=currency_api_conf.get('quote_max_items'),
+)
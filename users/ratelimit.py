@@ -0,0 +1,167 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from fastapi import HTTPException, Request, status
+
+from config import rate_limit_config
+from .security import decodeJWT
+
+
+def parse_rule(rule: str) -> tuple[float, float]:
+    """
+    "5/60" -> (скорость пополнения в токенах/с, ёмкость корзины)
+    """
+    count, seconds = rule.split('/')
+    return float(count) / float(seconds), float(count)
+
+
+class MemoryBucketStore:
+    """
+    Корзины токенов в памяти процесса. Порядок OrderedDict - порядок последнего
+    обращения, поэтому простаивающие корзины вытесняются с начала за O(1)
+    """
+
+    def __init__(self, max_buckets: int, idle_ttl: float):
+        self.max_buckets = max_buckets
+        self.idle_ttl = idle_ttl
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+        self.evictions = 0
+
+    def _evict(self, now: float) -> None:
+        while self._buckets:
+            key, (_, updated_at) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_buckets and now - updated_at < self.idle_ttl:
+                break
+            del self._buckets[key]
+            self.evictions += 1
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        """
+        Списать cost токенов. Возвращает 0, если можно, иначе через сколько секунд повторить
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        self._evict(now)
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0
+        return (cost - bucket[0]) / rate
+
+    def stats(self) -> dict[str, int]:
+        return {"buckets": len(self._buckets), "evictions": self.evictions}
+
+
+class RedisBucketStore:
+    """
+    Общие корзины для нескольких воркеров (нужен пакет redis)
+    """
+    SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local cost = tonumber(ARGV[4])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local tokens = tonumber(bucket[1]) or burst
+        local ts = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+        local retry = 0
+        if tokens >= cost then
+            tokens = tokens - cost
+        else
+            retry = (cost - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+        redis.call('EXPIRE', KEYS[1], ARGV[5])
+        return tostring(retry)
+    """
+
+    def __init__(self, url: str, idle_ttl: float):
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise RuntimeError("Для RATE_LIMIT_BACKEND=redis установите пакет redis")
+        self.idle_ttl = idle_ttl
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        retry = await self._script(
+            keys=[f"ratelimit:{key}"], args=[rate, burst, time.time(), cost, math.ceil(self.idle_ttl)]
+        )
+        return float(retry)
+
+    def stats(self) -> dict[str, str]:
+        return {"backend": "redis"}
+
+
+def build_store():
+    if rate_limit_config["backend"] == "redis":
+        return RedisBucketStore(rate_limit_config["redis_url"], rate_limit_config["idle_ttl"])
+    return MemoryBucketStore(rate_limit_config["max_buckets"], rate_limit_config["idle_ttl"])
+
+
+store = build_store()
+
+
+def client_ip(request: Request) -> str:
+    if rate_limit_config["trust_forwarded"]:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def principal(request: Request) -> str | None:
+    """
+    Кто делает запрос: пользователь из токена, а для входа - имя из формы
+    """
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        claims = decodeJWT(authorization[7:])
+        if claims:
+            return claims["sub"]
+    if request.headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+        form = await request.form()
+        username = form.get("username")
+        if username:
+            return str(username)
+    return None
+
+
+def rate_limit(route: str) -> Callable:
+    """
+    Зависимость FastAPI: ограничение частоты по IP и по пользователю для route из настроек
+    """
+    rules = rate_limit_config["routes"].get(route, {})
+    limits = {scope: parse_rule(rule) for scope, rule in rules.items()}
+
+    async def dependency(request: Request) -> None:
+        if not rate_limit_config["enabled"] or not limits:
+            return
+        keys = {}
+        if "ip" in limits:
+            keys["ip"] = f"{route}:ip:{client_ip(request)}"
+        if "user" in limits:
+            user = await principal(request)
+            if user is not None:
+                keys["user"] = f"{route}:user:{user}"
+        retry_after = 0.0
+        for scope, key in keys.items():
+            rate, burst = limits[scope]
+            retry_after = max(retry_after, await store.take(key, rate, burst))
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Слишком много запросов, попробуйте позже",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    return dependency
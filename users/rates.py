@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from decimal import Decimal, localcontext
+
+# точность промежуточных вычислений кросс-курса
+RATE_PRECISION = 50
+# знаков после запятой в ответах (как у внешнего API)
+RESULT_EXPONENT = Decimal("0.000001")
+
+
+@dataclass
+class RateTable:
+    """
+    Таблица курсов относительно одной базовой валюты
+    """
+    base: str
+    rates: dict[str, Decimal]
+    date: str | None = None
+    timestamp: int | None = None
+
+    def has(self, currency: str) -> bool:
+        return currency == self.base or currency in self.rates
+
+    def rate(self, currency_from: str, currency_to: str) -> Decimal:
+        """
+        Кросс-курс A -> base -> B
+        """
+        with localcontext() as ctx:
+            ctx.prec = RATE_PRECISION
+            rate_from = Decimal(1) if currency_from == self.base else self.rates[currency_from]
+            rate_to = Decimal(1) if currency_to == self.base else self.rates[currency_to]
+            return rate_to / rate_from
+
+    def convert(self, currency_from: str, currency_to: str, amount: Decimal) -> Decimal:
+        with localcontext() as ctx:
+            ctx.prec = RATE_PRECISION
+            return Decimal(amount) * self.rate(currency_from, currency_to)
+
+    def as_convert_response(self, currency_from: str, currency_to: str, amount: Decimal) -> dict:
+        """
+        Ответ в формате /convert внешнего API
+        """
+        with localcontext() as ctx:
+            ctx.prec = RATE_PRECISION
+            return {
+                "success": True,
+                "query": {"from": currency_from, "to": currency_to, "amount": amount},
+                "info": {
+                    "rate": self.rate(currency_from, currency_to).quantize(RESULT_EXPONENT),
+                    "timestamp": self.timestamp,
+                },
+                "date": self.date,
+                "result": self.convert(currency_from, currency_to, amount).quantize(RESULT_EXPONENT),
+            }
+
+    @classmethod
+    def from_latest(cls, data: dict) -> "RateTable":
+        """
+        Разбор ответа /latest внешнего API
+        """
+        return cls(
+            base=data["base"],
+            rates={symbol: Decimal(rate) for symbol, rate in data["rates"].items()},
+            date=data.get("date"),
+            timestamp=data.get("timestamp"),
+        )
@@ -0,0 +1,247 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+# момент (time.monotonic), к которому должен быть готов ответ на текущий запрос
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar('deadline', default=None)
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Внешний API курсов недоступен
+    """
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """
+    Предохранитель разомкнут - запрос к API не выполнялся
+    """
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    """
+    Бюджет времени запроса исчерпан
+    """
+
+
+class UpstreamFailed(UpstreamUnavailable):
+    """
+    API ответил ошибкой сервера или превышением квоты
+    """
+
+    def __init__(self, status_code: int):
+        super().__init__(f"API курсов ответил ошибкой {status_code}")
+        self.upstream_status = status_code
+
+
+class UpstreamRejected(Exception):
+    """
+    API отклонил запрос (4xx): неверные параметры - 400 клиенту, иначе (ключ, доступ) - 502
+    """
+    CLIENT_ERRORS = (400, 404, 422)
+
+    def __init__(self, status_code: int):
+        super().__init__(f"API курсов отклонил запрос: {status_code}")
+        self.upstream_status = status_code
+
+    @property
+    def status_code(self) -> int:
+        return 400 if self.upstream_status in self.CLIENT_ERRORS else 502
+
+
+def remaining() -> float | None:
+    """
+    Сколько секунд осталось до дедлайна текущего запроса (None - дедлайна нет)
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def set_deadline(seconds: float) -> contextvars.Token:
+    """
+    Установить дедлайн не позже уже действующего
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    return _deadline.set(deadline)
+
+
+def reset_deadline(token: contextvars.Token) -> None:
+    _deadline.reset(token)
+
+
+async def within_deadline(awaitable: Awaitable[Any]) -> Any:
+    """
+    Выполнить с учётом оставшегося бюджета времени
+    """
+    budget = remaining()
+    if budget is None:
+        return await awaitable
+    if budget <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded("Бюджет времени запроса исчерпан")
+    try:
+        return await asyncio.wait_for(awaitable, timeout=budget)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Бюджет времени запроса исчерпан")
+
+
+class DeadlineMiddleware:
+    """
+    Бюджет времени на весь запрос; его наследуют все обращения к внешнему API
+    """
+
+    def __init__(self, app, seconds: float):
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.seconds:
+            return await self.app(scope, receive, send)
+        token = set_deadline(self.seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_deadline(token)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold ошибок подряд запросы сразу отклоняются,
+    через reset_timeout пропускается пробный запрос
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self._probe_in_flight = False
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.successes += 1
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        self.state = self.CLOSED
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    async def call(self, func: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.allow():
+            self.rejected += 1
+            raise CircuitOpenError(f"API {self.name} временно недоступен")
+        try:
+            result = await func()
+        except (asyncio.CancelledError, DeadlineExceeded):
+            # исчерпан бюджет запроса клиента, а не сбой API
+            self._probe_in_flight = False
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "opened": self.opened,
+        }
+
+
+class LatencyTracker:
+    """
+    Скользящее окно задержек для расчёта перцентилей
+    """
+
+    def __init__(self, size: int):
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, percent: float) -> float | None:
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        index = min(len(samples) - 1, int(len(samples) * percent / 100))
+        return samples[index]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "samples": len(self._samples),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+async def hedged(func: Callable[[], Awaitable[Any]], delay: float | None) -> tuple[Any, bool]:
+    """
+    Если первый запрос не ответил за delay, отправить второй и взять первый успешный ответ.
+    Возвращает (результат, был ли отправлен второй запрос)
+    """
+    first = asyncio.ensure_future(func())
+    if delay is None:
+        return await first, False
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+    except asyncio.CancelledError:
+        first.cancel()
+        raise
+    if done:
+        return first.result(), False
+
+    second = asyncio.ensure_future(func())
+    pending = {first, second}
+    error: BaseException | None = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), True
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -48,7 +48,23 @@ class Login(BaseModel):
 
 class Token(BaseModel):
     access_token: str
+    refresh_token: str | None = None
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
     username: str = None
+
+
+class TokenClaims(BaseModel):
+    sub: str
+    uid: int
+    iat: int
+    exp: int
+    jti: str
+    role: str = "user"
+    active: bool = True
+    approved: bool = False
@@ -1,17 +1,23 @@
+import hashlib
+import secrets
 import time
+import uuid
+from datetime import datetime, timedelta, timezone
 
 import jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
-from passlib.context import CryptContext
 
 
-from .models import Users as DB_User
+from .hashing import hash_password, verify_password
+from .models import Users as DB_User, RefreshTokens
+from .principals import Principal, get_principal
+from .schemas import TokenClaims
+from .tokens import revocations, token_cache
 from config import auth_config
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/token")
-pwd_context = CryptContext(schemes=auth_config["hasher_schemes"], deprecated="auto")
 
 
 class User(BaseModel):
@@ -21,27 +27,38 @@ class User(BaseModel):
     disabled: bool | None = None
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await hash_password(password)
 
 
 async def authenticate_user(username: str, password: str):
     user = await DB_User.get_or_none(username=username)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    is_valid, new_hash = await verify_password(password, user.password)
+    if not is_valid:
         return False
+    # хэш со старой стоимостью или схемой пересчитывается при входе
+    if new_hash:
+        await DB_User.filter(id=user.id).update(password=new_hash)
+        user.password = new_hash
     return user
 
 
-def signJWT(username: str):
+def signJWT(user: DB_User):
+    """
+    Токен доступа с ролью и статусом пользователя
+    """
+    now = int(time.time())
     payload = {
-        "username": username,
-        "expires": time.time() + auth_config["expires"]
+        "sub": user.username,
+        "uid": user.id,
+        "iat": now,
+        "exp": now + auth_config["expires"],
+        "jti": uuid.uuid4().hex,
+        "role": "admin" if user.is_superuser else "user",
+        "active": user.is_active,
+        "approved": user.is_approved,
     }
     token = jwt.encode(
         payload=payload,
@@ -51,34 +68,133 @@ def signJWT(username: str):
     return {"access_token": token}
 
 
-def decodeJWT(token: str) -> dict:
+def decodeJWT(token: str) -> dict | None:
+    """
+    Проверенные утверждения токена (без повторной проверки подписи для известных токенов)
+    """
+    claims = token_cache.get(token)
+    if claims is not None:
+        return claims
     try:
-        decoded_token = jwt.decode(
+        claims = jwt.decode(
             jwt=token,
             key=auth_config["secret_key"],
-            algorithms=auth_config["algorithm"],
+            algorithms=[auth_config["algorithm"]],
+            options={"require": ["exp", "iat", "sub", "jti"]},
         )
-        return decoded_token if decoded_token["expires"] >= time.time() else None
-    except:
-        return {}
+    except jwt.InvalidTokenError:
+        return None
+    token_cache.put(token, claims)
+    return claims
+
+
+def _refresh_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def issue_refresh_token(user: DB_User, family: str | None = None) -> str:
+    """
+    Новый токен обновления; в базе хранится только его хэш
+    """
+    token = secrets.token_urlsafe(32)
+    await RefreshTokens.create(
+        user=user,
+        token_hash=_refresh_hash(token),
+        family=family or uuid.uuid4().hex,
+        expires_at=datetime.now(timezone.utc) + timedelta(seconds=auth_config["refresh_expires"]),
+    )
+    return token
+
+
+async def rotate_refresh_token(token: str) -> tuple[DB_User, str] | None:
+    """
+    Обмен токена обновления на новый. Повторное использование уже обменянного токена
+    считается кражей и отзывает всю цепочку
+    """
+    stored = await RefreshTokens.get_or_none(token_hash=_refresh_hash(token))
+    if stored is None:
+        return None
+    now = datetime.now(timezone.utc)
+    if stored.revoked_at is not None:
+        await RefreshTokens.filter(family=stored.family, revoked_at=None).update(revoked_at=now)
+        return None
+    if stored.expires_at <= now:
+        return None
+    # обменять токен может только один запрос
+    if not await RefreshTokens.filter(id=stored.id, revoked_at=None).update(revoked_at=now):
+        return None
+    user = await DB_User.get_or_none(id=stored.user_id, is_active=True)
+    if user is None:
+        return None
+    return user, await issue_refresh_token(user, family=stored.family)
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    token_dict = decodeJWT(token)
-    if not token_dict:
+async def revoke_refresh_token(token: str) -> bool:
+    """
+    Отозвать цепочку токенов обновления (выход)
+    """
+    stored = await RefreshTokens.get_or_none(token_hash=_refresh_hash(token))
+    if stored is None:
+        return False
+    await RefreshTokens.filter(family=stored.family, revoked_at=None).update(revoked_at=datetime.now(timezone.utc))
+    return True
+
+
+def revoke_access_token(claims: TokenClaims) -> None:
+    """
+    Отозвать токен доступа до истечения его срока (выход)
+    """
+    revocations.revoke_token(claims.jti, claims.exp)
+
+
+async def revoke_user_tokens(user_id: int) -> None:
+    """
+    Отозвать все выданные пользователю токены (блокировка)
+    """
+    revocations.revoke_subject(user_id)
+    await RefreshTokens.filter(user_id=user_id, revoked_at=None).update(revoked_at=datetime.now(timezone.utc))
+
+
+async def load_revocations() -> None:
+    """
+    Заблокированные пользователи в список отзыва (при старте приложения)
+    """
+    started = time.time()
+    for user_id in await DB_User.filter(is_active=False).values_list('id', flat=True):
+        revocations.revoke_subject(user_id, at=started)
+
+
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+async def get_token_claims(token: str = Depends(oauth2_scheme)) -> TokenClaims:
+    """
+    Утверждения действующего токена без обращения к базе
+    """
+    claims = decodeJWT(token)
+    if not claims or revocations.is_revoked(claims):
         raise credentials_exception
-    user = await  DB_User.get_or_none(username=token_dict['username'])
+    return TokenClaims(**claims)
+
+
+async def get_active_claims(claims: TokenClaims = Depends(get_token_claims)) -> TokenClaims:
+    if not claims.active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return claims
+
+
+async def get_current_user(claims: TokenClaims = Depends(get_token_claims)) -> Principal:
+    user = await get_principal(claims.sub)
     if user is None:
         raise credentials_exception
     return user
 
 
-async def get_current_active_user(current_user: DB_User = Depends(get_current_user)):
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)) -> Principal:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
@@ -0,0 +1,87 @@
+import asyncio
+import heapq
+import itertools
+from typing import Awaitable, Callable, Iterable, TypeVar
+
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from config import database_config
+from .db import read_connection
+from .models import BalanceSnapshot, Checks, HistoryConvert, JobCheckpoint, LedgerEntry, TransferPhase, Transfers
+
+T = TypeVar("T")
+
+# таблицы шардов; пользователи, токены, курсы и журнал переводов между шардами - в основной базе
+SHARDED_MODELS = (Checks, Transfers, HistoryConvert, LedgerEntry, BalanceSnapshot, JobCheckpoint, TransferPhase)
+
+
+def sharding_enabled() -> bool:
+    return bool(database_config["shard_urls"])
+
+
+def shard_names() -> list[str]:
+    return [f"shard_{number}" for number in range(len(database_config["shard_urls"]))]
+
+
+def shard_name(user_id: int) -> str:
+    """
+    Соединение с данными пользователя: шард user_id % число шардов, без шардов - основная база
+    """
+    if not sharding_enabled():
+        return "default"
+    return f"shard_{user_id % len(database_config['shard_urls'])}"
+
+
+def user_connection(user_id: int) -> BaseDBAsyncClient:
+    """
+    Соединение для записи (и чтения своих данных сразу после записи) пользователя
+    """
+    return connections.get(shard_name(user_id))
+
+
+def user_read_connection(user_id: int) -> BaseDBAsyncClient:
+    """
+    Чтение данных пользователя: его шард, без шардов - реплика или основная база
+    """
+    return user_connection(user_id) if sharding_enabled() else read_connection()
+
+
+def data_connection_names() -> list[str]:
+    """
+    Соединения с таблицами счетов, переводов, конвертаций и журнала
+    """
+    return shard_names() or ["default"]
+
+
+def read_connections() -> list[BaseDBAsyncClient]:
+    """
+    Соединения для чтения по всем пользователям: все шарды или одна база
+    """
+    if sharding_enabled():
+        return [connections.get(name) for name in shard_names()]
+    return [read_connection()]
+
+
+def data_name(connection: BaseDBAsyncClient) -> str:
+    """
+    Имя базы с данными для соединения чтения: шард или основная база (а не её реплика)
+    """
+    return connection.connection_name if sharding_enabled() else "default"
+
+
+async def fan_out(query: Callable[[BaseDBAsyncClient], Awaitable[T]]) -> list[T]:
+    """
+    Выполнить query(connection) на всех шардах параллельно
+    """
+    return list(await asyncio.gather(*(query(connection) for connection in read_connections())))
+
+
+def merge_pages(pages: Iterable[list[T]], limit: int) -> list[T]:
+    """
+    Слить страницы шардов (каждая от новых к старым по (created_at, id)) в одну.
+    Берётся limit + 1 запись, чтобы PageParams.page увидел следующую страницу.
+    id на разных шардах независимы: курсор однозначен, пока created_at не совпадают до микросекунды
+    """
+    merged = heapq.merge(*pages, key=lambda row: (row.created_at, row.id), reverse=True)
+    return list(itertools.islice(merged, limit + 1))
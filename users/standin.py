@@ -0,0 +1,142 @@
+"""
+Локальный заменитель API курсов (формат exchangerates_data).
+
+Курсы детерминированы (зависят только от валюты и даты) или берутся из файла
+local_fixture: {"base": "EUR", "rates": {"USD": 1.03, ...}, "symbols": {"USD": "United States Dollar", ...}}.
+Задержка ответа задаётся local_latency и local_jitter.
+
+Отдельный сервер: uvicorn users.standin:app --port 8001
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from datetime import date, timedelta
+from decimal import Context, Decimal, localcontext
+
+from fastapi import FastAPI, HTTPException, Query, status
+
+from config import currency_api_conf
+from .currency import CurrencyType
+from .rates import RATE_PRECISION, RESULT_EXPONENT
+
+# опорная валюта детерминированных курсов
+STANDIN_BASE = "EUR"
+# значащих цифр в курсах ответа
+RATE_DIGITS = 12
+
+app = FastAPI(title="Currency API stand-in")
+
+
+def _load_fixture() -> dict | None:
+    path = currency_api_conf.get('local_fixture')
+    if not path:
+        return None
+    with open(path, encoding="utf-8") as file:
+        return json.load(file, parse_float=Decimal)
+
+
+_fixture = _load_fixture()
+
+
+def _symbols() -> dict[str, str]:
+    if _fixture:
+        return _fixture.get("symbols") or {symbol: symbol for symbol in [_fixture["base"], *_fixture["rates"]]}
+    return {currency.name: currency.value for currency in CurrencyType}
+
+
+def _deterministic_rate(symbol: str, day: date) -> Decimal:
+    """
+    Курс symbol к EUR: постоянный уровень из хэша кода валюты и плавное колебание по дням
+    """
+    digest = hashlib.sha256(symbol.encode()).digest()
+    level = 0.2 + int.from_bytes(digest[:4], 'big') / 2 ** 32 * 150
+    wave = math.sin(day.toordinal() / 30 + digest[4]) * 0.05
+    return Decimal(repr(round(level * (1 + wave), 6)))
+
+
+def _unit_rate(symbol: str, day: date) -> Decimal:
+    """
+    Сколько symbol дают за единицу опорной валюты (базы файла курсов или EUR)
+    """
+    if _fixture:
+        return Decimal(1) if symbol == _fixture["base"] else Decimal(_fixture["rates"][symbol])
+    if symbol == STANDIN_BASE:
+        return Decimal(1)
+    return _deterministic_rate(symbol, day)
+
+
+def _table(base: str, symbols: list[str], day: date) -> dict[str, Decimal]:
+    known = _symbols()
+    for symbol in [base, *symbols]:
+        if symbol not in known:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Неизвестная валюта {symbol}")
+    with localcontext() as ctx:
+        ctx.prec = RATE_DIGITS
+        base_rate = _unit_rate(base, day)
+        return {symbol: _unit_rate(symbol, day) / base_rate for symbol in symbols}
+
+
+def _requested(symbols: str | None) -> list[str]:
+    if symbols:
+        return [symbol.strip().upper() for symbol in symbols.split(',') if symbol.strip()]
+    return list(_symbols())
+
+
+@app.middleware("http")
+async def simulated_latency(request, call_next):
+    latency = currency_api_conf.get('local_latency') + random.uniform(0, currency_api_conf.get('local_jitter'))
+    if latency > 0:
+        await asyncio.sleep(latency)
+    return await call_next(request)
+
+
+@app.get("/symbols")
+async def symbols():
+    return {"success": True, "symbols": _symbols()}
+
+
+@app.get("/latest")
+async def latest(base: str = STANDIN_BASE, symbols: str | None = None):
+    today = date.today()
+    return {
+        "success": True,
+        "timestamp": int(time.time()),
+        "base": base.upper(),
+        "date": str(today),
+        "rates": _table(base.upper(), _requested(symbols), today),
+    }
+
+
+@app.get("/convert")
+async def convert(amount: Decimal, to: str, currency_from: str = Query(..., alias="from")):
+    today = date.today()
+    rate = _table(currency_from.upper(), [to.upper()], today)[to.upper()]
+    return {
+        "success": True,
+        "query": {"from": currency_from.upper(), "to": to.upper(), "amount": amount},
+        "info": {"rate": rate, "timestamp": int(time.time())},
+        "date": str(today),
+        "result": (amount * rate).quantize(RESULT_EXPONENT, context=Context(prec=RATE_PRECISION)),
+    }
+
+
+@app.get("/timeseries")
+async def timeseries(start_date: date, end_date: date, base: str = STANDIN_BASE, symbols: str | None = None):
+    if start_date > end_date:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Неверный период")
+    requested = _requested(symbols)
+    days = (end_date - start_date).days + 1
+    return {
+        "success": True,
+        "timeseries": True,
+        "start_date": str(start_date),
+        "end_date": str(end_date),
+        "base": base.upper(),
+        "rates": {
+            str(day): _table(base.upper(), requested, day)
+            for day in (start_date + timedelta(days=n) for n in range(days))
+        },
+    }
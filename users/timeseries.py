@@ -0,0 +1,116 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from config import currency_api_conf
+from .converter import currency_timeseries, current_rates
+from .models import DailyRate
+from .rates import RESULT_EXPONENT
+
+
+def _days(start: date, end: date) -> list[date]:
+    return [start + timedelta(days=n) for n in range((end - start).days + 1)]
+
+
+def _spans(days: list[date], max_days: int) -> list[tuple[date, date]]:
+    """
+    Непрерывные отрезки из отсортированных дат, не длиннее max_days
+    """
+    spans = []
+    for day in days:
+        if spans and day - spans[-1][1] == timedelta(days=1) and (day - spans[-1][0]).days < max_days:
+            spans[-1][1] = day
+        else:
+            spans.append([day, day])
+    return [(span_start, span_end) for span_start, span_end in spans]
+
+
+async def _fetch_missing(
+        base: str, symbols: list[str], start: date, end: date, stored: set[tuple[str, date]]
+) -> list[DailyRate]:
+    """
+    Догрузить из внешнего API только недостающие дни (прошлые курсы не меняются)
+    """
+    symbols = [symbol for symbol in symbols if symbol != base]
+    if start > end or not symbols:
+        return []
+    missing = [day for day in _days(start, end) if any((symbol, day) not in stored for symbol in symbols)]
+
+    created = []
+    for span_start, span_end in _spans(missing, currency_api_conf.get('timeseries_max_days')):
+        wanted = [
+            symbol for symbol in symbols
+            if any((symbol, day) not in stored for day in _days(span_start, span_end))
+        ]
+        data = await currency_timeseries(
+            start_date=str(span_start), end_date=str(span_end), base=base, symbols=','.join(wanted)
+        )
+        objects = [
+            DailyRate(date=day, base=base, symbol=symbol, rate=Decimal(rate))
+            for day, rates in ((date.fromisoformat(key), value) for key, value in data.get('rates', {}).items())
+            for symbol, rate in rates.items()
+            if symbol in wanted and (symbol, day) not in stored
+        ]
+        if objects:
+            await DailyRate.bulk_create(objects, ignore_conflicts=True)
+            created.extend(objects)
+    return created
+
+
+async def load_series(base: str, symbols: list[str], start: date, end: date) -> dict[str, list[tuple[date, Decimal]]]:
+    """
+    Дневные курсы base -> symbol за период (сегодняшний курс берётся из текущей таблицы)
+    """
+    today = date.today()
+    end = min(end, today)
+
+    # одна выборка по индексу (base, symbol, date)
+    rows = await DailyRate.filter(
+        base=base, symbol__in=symbols, date__gte=start, date__lte=end
+    ).order_by('date').values_list('symbol', 'date', 'rate')
+    stored = {(symbol, day) for symbol, day, _ in rows}
+    created = await _fetch_missing(base, symbols, start, min(end, today - timedelta(days=1)), stored)
+    if created:
+        rows = sorted(
+            [*rows, *((item.symbol, item.date, item.rate) for item in created)], key=lambda row: row[1]
+        )
+
+    series: dict[str, list[tuple[date, Decimal]]] = {symbol: [] for symbol in symbols}
+    for symbol, day, rate in rows:
+        series[symbol].append((day, rate))
+
+    if base in series:
+        series[base] = [(day, Decimal(1)) for day in _days(start, end)]
+    if end == today:
+        table = await current_rates()
+        if table is not None and table.has(base):
+            for symbol in symbols:
+                if symbol != base and table.has(symbol):
+                    series[symbol].append((today, table.rate(base, symbol)))
+    return series
+
+
+async def rate_fluctuation(base: str, symbols: list[str], start: date, end: date) -> dict:
+    """
+    Колебания курсов за период в формате /fluctuation внешнего API
+    """
+    series = await load_series(base, symbols, start, end)
+    rates = {}
+    for symbol, points in series.items():
+        if not points:
+            continue
+        start_rate, end_rate = points[0][1], points[-1][1]
+        change = end_rate - start_rate
+        rates[symbol] = {
+            "start_rate": start_rate.quantize(RESULT_EXPONENT),
+            "end_rate": end_rate.quantize(RESULT_EXPONENT),
+            "change": change.quantize(Decimal("0.0001")),
+            "change_pct": (change / start_rate * 100).quantize(Decimal("0.0001")) if start_rate else None,
+        }
+    return {
+        "success": True,
+        "fluctuation": True,
+        "start_date": str(start),
+        "end_date": str(end),
+        "base": base,
+        "rates": rates,
+    }
@@ -0,0 +1,85 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any
+
+from config import auth_config
+
+
+def token_key(token: str) -> bytes:
+    """
+    Ключ кэша: хэш токена, а не сам токен
+    """
+    return hashlib.sha256(token.encode()).digest()
+
+
+class VerifiedTokenCache:
+    """
+    Уже проверенные токены: LRU, запись живёт не дольше срока действия токена
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: OrderedDict[bytes, dict] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> dict | None:
+        key = token_key(token)
+        claims = self._items.get(key)
+        if claims is None:
+            self.misses += 1
+            return None
+        if claims["exp"] <= time.time():
+            del self._items[key]
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return claims
+
+    def put(self, token: str, claims: dict) -> None:
+        key = token_key(token)
+        self._items[key] = claims
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def stats(self) -> dict[str, Any]:
+        return {"size": len(self._items), "max_items": self.max_items, "hits": self.hits, "misses": self.misses}
+
+
+class RevocationList:
+    """
+    Отозванные токены в памяти: отдельные jti до их истечения
+    и пользователи, чьи токены выданы до момента отзыва (блокировка)
+    """
+
+    def __init__(self):
+        self._tokens: dict[str, float] = {}
+        self._subjects: dict[int, float] = {}
+
+    def _purge(self) -> None:
+        now = time.time()
+        for jti in [jti for jti, expires_at in self._tokens.items() if expires_at <= now]:
+            del self._tokens[jti]
+
+    def revoke_token(self, jti: str, expires_at: float) -> None:
+        self._purge()
+        self._tokens[jti] = expires_at
+
+    def revoke_subject(self, user_id: int, at: float | None = None) -> None:
+        self._subjects[user_id] = time.time() if at is None else at
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims["jti"] in self._tokens:
+            return True
+        revoked_at = self._subjects.get(claims["uid"])
+        return revoked_at is not None and claims["iat"] <= revoked_at
+
+    def stats(self) -> dict[str, int]:
+        return {"tokens": len(self._tokens), "subjects": len(self._subjects)}
+
+
+token_cache = VerifiedTokenCache(max_items=auth_config["token_cache_size"])
+revocations = RevocationList()
@@ -0,0 +1,250 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
+
+from tortoise import connections, timezone
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.exceptions import IntegrityError
+from tortoise.transactions import in_transaction
+
+from config import database_config
+from .balances import credit, debit, lock_checks
+from .currency import PostingKind, SystemAccount, TransferState, TransferStep
+from .ledger import record
+from .models import Checks, TransferIntent, TransferPhase, Transfers
+from .shards import shard_name, sharding_enabled
+
+logger = logging.getLogger(__name__)
+
+Action = Callable[[BaseDBAsyncClient, TransferPhase], Awaitable[Any]]
+
+
+class TransferAborted(Exception):
+    """
+    Перевод между шардами отменён восстановлением, пока шла подготовка
+    """
+
+
+class RecipientUnavailable(Exception):
+    """
+    Открытого счёта получателя нет: перевод откатывается
+    """
+
+
+async def _done(intent: TransferIntent, step: TransferStep, connection: BaseDBAsyncClient) -> bool:
+    return await TransferPhase.filter(intent_id=intent.id, phase=step).using_db(connection).exists()
+
+
+async def _step(intent: TransferIntent, user_id: int, step: TransferStep, action: Action) -> Any:
+    """
+    Выполнить шаг на шарде пользователя в одной транзакции с отметкой TransferPhase.
+    Уже выполненный шаг пропускается (None): так шаги безопасно повторять при восстановлении.
+    Если шаг одновременно выполнил другой (восстановление), отметка нарушает уникальность - тоже None
+    """
+    name = shard_name(user_id)
+    try:
+        async with in_transaction(name) as connection:
+            if await _done(intent, step, connection):
+                return None
+            phase = await TransferPhase.create(intent_id=intent.id, phase=step, using_db=connection)
+            return await action(connection, phase)
+    except IntegrityError:
+        if await _done(intent, step, connections.get(name)):
+            return None
+        raise
+
+
+async def _decide(intent: TransferIntent, current: TransferState, new: TransferState, **fields) -> TransferState:
+    """
+    Переход состояния в журнале, только из current: при гонке с восстановлением
+    побеждает один, второй получает его решение
+    """
+    updated = await TransferIntent.filter(id=intent.id, state=current).update(
+        state=new, updated_at=timezone.now(), **fields
+    )
+    if updated:
+        intent.state = new
+    else:
+        await intent.refresh_from_db(fields=["state"])
+    return intent.state
+
+
+async def _prepare(intent: TransferIntent) -> None:
+    """
+    Отправитель: списание на транзитный счёт. Получатель: проверка открытого счёта
+    """
+    async def hold(connection: BaseDBAsyncClient, phase: TransferPhase) -> None:
+        # счёт блокируется и в откате: списание и возврат не разминутся
+        await lock_checks(connection, intent.check_from_id)
+        # опоздавшая подготовка: восстановление уже откатывает перевод
+        if await _done(intent, TransferStep.abort, connection):
+            raise TransferAborted(intent.id)
+        if not await TransferIntent.filter(id=intent.id, state=TransferState.started).exists():
+            raise TransferAborted(intent.id)
+        check = await Checks.get(id=intent.check_from_id).using_db(connection)
+        await debit(connection, check.id, intent.value)
+        await record(
+            connection,
+            PostingKind.transfer,
+            (check, check.currency_type, -intent.value),
+            (SystemAccount.transit, check.currency_type, intent.value),
+        )
+
+    async def vote(connection: BaseDBAsyncClient, phase: TransferPhase) -> None:
+        if not await Checks.filter(id=intent.check_to_id, is_open=True).using_db(connection).exists():
+            raise RecipientUnavailable(intent.check_to_id)
+
+    await _step(intent, intent.user_from_id, TransferStep.prepare, hold)
+    await _step(intent, intent.user_to_id, TransferStep.prepare, vote)
+
+
+async def _commit(intent: TransferIntent) -> Transfers:
+    """
+    Зачисление получателю с транзитного счёта, затем запись перевода на шарде отправителя
+    """
+    async def release(connection: BaseDBAsyncClient, phase: TransferPhase) -> None:
+        check = await Checks.get(id=intent.check_to_id).using_db(connection)
+        await credit(connection, check.id, intent.value)
+        await record(
+            connection,
+            PostingKind.transfer,
+            (SystemAccount.transit, check.currency_type, -intent.value),
+            (check, check.currency_type, intent.value),
+        )
+
+    async def complete(connection: BaseDBAsyncClient, phase: TransferPhase) -> None:
+        transfer = await Transfers.create(
+            user_from_id=intent.user_from_id,
+            user_to_id=intent.user_to_id,
+            value=intent.value,
+            currency_type=intent.currency_type,
+            using_db=connection,
+        )
+        phase.transfer_id = transfer.id
+        await phase.save(using_db=connection, update_fields=["transfer_id"])
+
+    await _step(intent, intent.user_to_id, TransferStep.commit, release)
+    await _step(intent, intent.user_from_id, TransferStep.commit, complete)
+    # запись перевода ищется по отметке шага: его мог выполнить и другой (восстановление)
+    connection = connections.get(shard_name(intent.user_from_id))
+    phase = await TransferPhase.get(intent_id=intent.id, phase=TransferStep.commit).using_db(connection)
+    await _decide(intent, TransferState.committing, TransferState.committed, transfer_id=phase.transfer_id)
+    return await Transfers.get(id=phase.transfer_id).using_db(connection)
+
+
+async def _abort(intent: TransferIntent) -> None:
+    """
+    Возврат отправителю, если списание на транзитный счёт успело пройти
+    """
+    async def refund(connection: BaseDBAsyncClient, phase: TransferPhase) -> None:
+        await lock_checks(connection, intent.check_from_id)
+        if not await _done(intent, TransferStep.prepare, connection):
+            return
+        check = await Checks.get(id=intent.check_from_id).using_db(connection)
+        await credit(connection, check.id, intent.value)
+        await record(
+            connection,
+            PostingKind.transfer,
+            (SystemAccount.transit, check.currency_type, -intent.value),
+            (check, check.currency_type, intent.value),
+        )
+
+    await _step(intent, intent.user_from_id, TransferStep.abort, refund)
+    await _decide(intent, TransferState.aborting, TransferState.aborted)
+
+
+async def transfer_between_shards(check_from: Checks, check_to: Checks, value) -> Transfers:
+    """
+    Перевод между счетами на разных шардах двухфазной фиксацией: журнал в основной базе,
+    подготовка обоих шардов, решение в журнале, затем шаги фиксации (или отката)
+    """
+    intent = await TransferIntent.create(
+        user_from_id=check_from.owner_id,
+        user_to_id=check_to.owner_id,
+        check_from_id=check_from.id,
+        check_to_id=check_to.id,
+        currency_type=check_from.currency_type,
+        value=value,
+    )
+    try:
+        await _prepare(intent)
+    except Exception:
+        if await _decide(intent, TransferState.started, TransferState.aborting) == TransferState.aborting:
+            await _abort(intent)
+        raise
+    if await _decide(intent, TransferState.started, TransferState.committing) != TransferState.committing:
+        raise TransferAborted(intent.id)
+    return await _commit(intent)
+
+
+async def recover_transfers(delay: float) -> int:
+    """
+    Довести переводы, прерванные сбоем (запись в журнале не менялась дольше delay секунд):
+    неподготовленные откатываются, по принятому решению шаги повторяются. Возвращает число переводов
+    """
+    horizon = timezone.now() - timedelta(seconds=delay)
+    intents = await TransferIntent.filter(
+        state__in=[TransferState.started, TransferState.committing, TransferState.aborting], updated_at__lt=horizon
+    ).order_by("id")
+    for intent in intents:
+        try:
+            if intent.state == TransferState.started:
+                await _decide(intent, TransferState.started, TransferState.aborting)
+            if intent.state == TransferState.committing:
+                await _commit(intent)
+            elif intent.state == TransferState.aborting:
+                await _abort(intent)
+        except Exception as e:
+            logger.warning("Перевод между шардами %s не восстановлен: %r", intent.id, e)
+    return len(intents)
+
+
+class TransferRecovery:
+    """
+    Фоновое восстановление переводов между шардами
+    """
+
+    def __init__(self, interval: float, delay: float):
+        self.interval = interval
+        self.delay = delay
+        self.recovered = 0
+        self.recovered_at: datetime | None = None
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self.recovered += await recover_transfers(self.delay)
+                self.recovered_at = timezone.now()
+            except Exception as e:
+                logger.warning("Восстановление переводов между шардами не удалось: %r", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict[str, Any]:
+        return {"recovered": self.recovered, "recovered_at": self.recovered_at}
+
+
+transfer_recovery = TransferRecovery(
+    interval=database_config["shard_recovery_interval"],
+    delay=database_config["shard_recovery_delay"],
+)
+
+
+def start_transfer_recovery() -> None:
+    if sharding_enabled():
+        transfer_recovery.start()
+
+
+async def stop_transfer_recovery() -> None:
+    await transfer_recovery.stop()